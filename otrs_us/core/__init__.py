@@ -13,9 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 "interactor"
+import atexit
 from .settings import Config, Password
 from .database import Database
 from .ptime import TimeUnit
+from .connpool import ConnectionPool
+from .respcache import ResponseCache, ParseMemo
+from .aioload import Engine, ParseOffload
+from .pgload import SingleFlight
+from .replay import Recorder
+from .session import SessionKeeper
+from .dumper import DumpWriter
 version = "0.8"
 
 
@@ -47,16 +55,56 @@ def get_core():
     for item, obj, defv in (
             ("refresh_time", TimeUnit, "1 m"),
             ("still_relevant", TimeUnit, "4 w"),
-            ("password", Password, "")):
+            ("pool_idle", TimeUnit, "4 s"),
+            ("session_lifetime", TimeUnit, "10 h"),
+            ("session_idle", TimeUnit, "2 h"),
+            ("dump_max_age", TimeUnit, "1 w"),
+            ("password", Password, ""),
+            ("session", Password, "")):
         try:
             cfg[item] = obj(cfg[item])
         except Exception:
             cfg[item] = obj(defv)
     for i, j in (("tct_tm_fmt", "%m/%d/%Y %H:%M"),
-                 ("art_tm_fmt", "%Y-%m-%d %H:%M:%S")):
+                 ("art_tm_fmt", "%Y-%m-%d %H:%M:%S"),
+                 ("pool_size", 4), ("pool_requests", 100),
+                 ("cache_size", 16 << 20), ("workers", 8),
+                 ("prefetch_workers", 4), ("warmup_workers", 2),
+                 ("warmup_budget", 10), ("query_page", 0),
+                 ("query_limit", 100), ("dump_max_size", 64 << 20),
+                 ("dump_rates", {}), ("parse_processes", 0),
+                 ("parse_offload_size", 1 << 20), ("memo_entries", 64),
+                 ("memo_size", 8 << 20)):
         cfg.setdefault(i, j)
     actor.register("core cfg", lambda x: x, cfg)
-    actor.register("runtime cfg", lambda x: x, dict(cfg))
+    runt_cfg = dict(cfg)
+    actor.register("runtime cfg", lambda x: x, runt_cfg)
+    actor.register("session", lambda x: x, SessionKeeper(cfg, runt_cfg))
+    pool = ConnectionPool(cfg["pool_size"], cfg["pool_idle"],
+                          cfg["pool_requests"])
+    actor.register("connection pool", lambda x: x, pool)
+    actor.register(
+        "response cache", lambda x: x, ResponseCache(cfg["cache_size"]))
+    actor.register("parse memo", lambda x: x,
+                   ParseMemo(cfg["memo_entries"], cfg["memo_size"]))
+    actor.register("engine", lambda x: x, Engine(cfg["workers"]))
+    offload = ParseOffload(cfg["parse_processes"], cfg["parse_offload_size"])
+    offload.start()
+    atexit.register(offload.stop)
+    actor.register("parse offload", lambda x: x, offload)
+    actor.register("single flight", lambda x: x, SingleFlight())
+    recorder = None
+    if cfg.get("record_to"):
+        recorder = Recorder(cfg["record_to"])
+        atexit.register(recorder.close)
+    actor.register("recorder", lambda: recorder)
+    dumper = None
+    if cfg.get("pg_dump_to"):
+        dumper = DumpWriter(
+            cfg["pg_dump_to"][0], cfg["pg_dump_to"][1:],
+            cfg["dump_max_size"], cfg["dump_max_age"], cfg["dump_rates"])
+        atexit.register(dumper.close)
+    actor.register("dump writer", lambda: dumper)
     db = Database("core.db", True)
     actor.register("database", lambda x: x, db)
     db.delete_irrelevant(cfg["still_relevant"])
@@ -0,0 +1,143 @@
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"Asynchronous page loading"
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from queue import Queue, Empty
+from threading import Thread, Lock, current_thread, main_thread
+from traceback import print_exc
+
+
+class Engine:
+    """Single background event loop which runs the loaders.
+    The sockets are served by the pooled connections in a fixed set
+    of worker threads, the loop schedules them, bounds concurrency
+    and hands the results over to the GUI thread."""
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.__loop = None
+        self.__lock = Lock()
+        self.__limits = {}
+        self.__handoff = Queue()
+
+    def loop(self):
+        "The event loop, it starts on demand"
+        with self.__lock:
+            if self.__loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="otrs_us"))
+                t = Thread(target=self.__run, args=(loop,))
+                t.daemon = True
+                t.start()
+                self.__loop = loop
+        return self.__loop
+
+    @staticmethod
+    def __run(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def limit(self, name, value):
+        "Named semaphore bounding a kind of operations (in the loop only)"
+        sem = self.__limits.get(name)
+        if sem is None:
+            sem = self.__limits[name] = asyncio.Semaphore(value)
+        return sem
+
+    async def run(self, func, *args, limit=None):
+        "Run blocking function in worker thread"
+        loop = asyncio.get_running_loop()
+        if limit is None:
+            return await loop.run_in_executor(None, partial(func, *args))
+        async with self.limit(*limit):
+            return await loop.run_in_executor(None, partial(func, *args))
+
+    def submit(self, coro, callback=None):
+        """Schedule the coroutine from any thread. Returned future can be
+        cancelled. The callback gets the future in the GUI thread."""
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop())
+        if callback is not None:
+            fut.add_done_callback(partial(self.handoff, callback))
+        return fut
+
+    def call(self, func, *args, callback=None, limit=None):
+        "Submit blocking function"
+        return self.submit(self.run(func, *args, limit=limit), callback)
+
+    def handoff(self, func, *args):
+        "Ask the GUI thread to call func(*args)"
+        self.__handoff.put((func, args))
+
+    def pump(self):
+        "Call the handed over functions, should be called by the GUI thread"
+        count = 0
+        while True:
+            try:
+                func, args = self.__handoff.get_nowait()
+            except Empty:
+                return count
+            count += 1
+            try:
+                func(*args)
+            except Exception:
+                print_exc()
+
+    def stop(self):
+        with self.__lock:
+            loop, self.__loop = self.__loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+
+class ParseOffload:
+    """Pool of processes parsing the pages bigger than threshold. The
+    workers are forked when the pool starts, so it should be started
+    before the threads are. Without fork the offload stays disabled."""
+    def __init__(self, processes=0, threshold=1 << 20):
+        self.processes = processes
+        self.threshold = threshold
+        # waiter(future) is used instead of future.result() in the
+        # main thread, GUI sets it to keep the window painted
+        self.waiter = None
+        self.__pool = None
+
+    def enabled(self):
+        return self.__pool is not None
+
+    def start(self):
+        if self.processes <= 0 or self.__pool is not None:
+            return
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            return
+        self.__pool = ProcessPoolExecutor(self.processes, context)
+        # fork all the workers now
+        self.__pool.submit(int).result()
+
+    def run(self, func, *args):
+        "Call func in a worker process and wait for its result"
+        fut = self.__pool.submit(func, *args)
+        if self.waiter is not None and current_thread() is main_thread():
+            return self.waiter(fut)
+        return fut.result()
+
+    def stop(self):
+        pool, self.__pool = self.__pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
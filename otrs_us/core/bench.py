@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"Benchmarks of the page parsers on the synthesized pages"
+
+import gc
+import json
+import platform
+import tracemalloc
+from time import perf_counter, strftime
+from . import synth
+from .parse.dashboard import DashboardParser
+from .parse.tickets import TicketsParser
+from .parse.messages import MessageParser, AnswerParser
+from .pgload import CHUNK_SIZE
+
+
+def zoom_page(articles):
+    return synth.ticket_page(1, articles)
+
+
+# parser, page generator, sizes and the smaller sizes for --quick
+CASES = (
+    ("DashboardParser", DashboardParser, synth.dashboard_page,
+     (10, 1000, 10000), (10, 1000)),
+    ("TicketsParser", TicketsParser, zoom_page,
+     (10, 100, 1000), (10, 100)),
+    ("MessageParser", MessageParser, synth.message_page,
+     (1 << 10, 100 << 10, 10 << 20), (1 << 10, 100 << 10)),
+    ("AnswerParser", AnswerParser, synth.answer_page,
+     (10, 100, 1000), (10, 100)))
+
+
+def parse(parser_class, chunks):
+    parser = parser_class()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return parser
+
+
+def measure(parser_class, page, repeat=5):
+    "Best time, peak memory and blocks kept by the parser"
+    text = page.decode()
+    chunks = [text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = perf_counter()
+        parse(parser_class, chunks)
+        spent = perf_counter() - start
+        if best is None or spent < best:
+            best = spent
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    parser = parse(parser_class, chunks)
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # the snapshots are allocated by tracemalloc itself
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    kept = after.filter_traces(ignore).compare_to(
+        before.filter_traces(ignore), "filename")
+    del parser
+    return {"bytes": len(page), "seconds": best,
+            "mb_per_s": len(page) / best / 1e6 if best else None,
+            "peak_kb": peak / 1024.,
+            "kept_kb": sum(stat.size_diff for stat in kept) / 1024.,
+            "kept_blocks": sum(stat.count_diff for stat in kept)}
+
+
+def run(quick=False, repeat=5, only=None, old={}):
+    "old are the results of an earlier run to compare with"
+    results = {}
+    for name, parser_class, generator, sizes, quick_sizes in CASES:
+        if only and name not in only:
+            continue
+        for size in (quick_sizes if quick else sizes):
+            page = generator(size)
+            key = "%s/%d" % (name, size)
+            results[key] = measure(parser_class, page, repeat)
+            print(report_line(key, results[key], old.get(key)))
+    return results
+
+
+def report_line(key, res, old=None):
+    line = "%-24s %9.1f KB %8.2f MB/s %9.1f KB peak %8d blocks" % (
+        key, res["bytes"] / 1024., res["mb_per_s"], res["peak_kb"],
+        res["kept_blocks"])
+    if old is not None and old.get("mb_per_s"):
+        line += "  x%.2f" % (res["mb_per_s"] / old["mb_per_s"])
+    return line
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Benchmark the page parsers")
+    parser.add_argument("-q", "--quick", action="store_true",
+                        help="skip the biggest pages")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-p", "--parser", action="append",
+                        help="benchmark only this parser")
+    parser.add_argument("-o", "--output", help="save results to JSON file")
+    parser.add_argument("-c", "--compare", help="JSON file of earlier run")
+    args = parser.parse_args()
+    old = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            old = json.load(fp)["results"]
+        print("Compared with", args.compare)
+    results = run(args.quick, args.repeat, args.parser, old)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({"time": strftime("%Y-%m-%d %H:%M:%S"),
+                       "python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "results": results}, fp, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"Pool of the persistent HTTP connections"
+
+import ssl
+from base64 import b64encode
+from http.client import (
+    HTTPConnection, HTTPSConnection, BadStatusLine, CannotSendRequest)
+from threading import Lock
+from time import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urlsplit, urljoin
+from urllib.request import getproxies, proxy_bypass
+MAX_REDIRECTS = 10
+# unread rest of the body which is read to keep the connection
+DRAIN_LIMIT = 16 << 10
+# errors which mean that the server has dropped an idle connection
+STALE_ERRORS = (BadStatusLine, CannotSendRequest, ConnectionError)
+# methods which may be sent again when the reused connection has failed
+IDEMPOTENT = ("GET", "HEAD")
+# seconds the connection may be idle to be reused for other methods
+FRESH_IDLE = 1.
+
+
+class _HTTPSConnection(HTTPSConnection):
+    "HTTPS connection which resumes TLS sessions"
+    def __init__(self, host, port, timeout, context, sessions):
+        HTTPSConnection.__init__(
+            self, host, port, timeout=timeout, context=context)
+        self.__context = context
+        self.__sessions = sessions
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        # the host is the proxy's one when the connection is tunneled
+        host = self._tunnel_host or self.host
+        key = (host, self._tunnel_port or self.port)
+        session = self.__sessions.get(key)
+        try:
+            self.sock = self.__context.wrap_socket(
+                self.sock, server_hostname=host, session=session)
+        except ssl.SSLError:
+            if session is None:
+                raise
+            # the server refused our ticket, begin from scratch
+            self.__sessions.pop(key, None)
+            HTTPConnection.connect(self)
+            self.sock = self.__context.wrap_socket(
+                self.sock, server_hostname=host)
+        if self.sock.session is not None:
+            self.__sessions[key] = self.sock.session
+
+
+class PooledResponse:
+    """Response which returns its connection into the pool when the body
+    was read. Provides the subset of urlopen's response interface
+    used by the page loaders."""
+    def __init__(self, pool, key, conn, resp, url):
+        self.__pool = pool
+        self.__key = key
+        self.__conn = conn
+        self.__resp = resp
+        self.url = url
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.__resp.status
+
+    @property
+    def reason(self):
+        return self.__resp.reason
+
+    def getheader(self, name, default=None):
+        return self.__resp.getheader(name, default)
+
+    def getheaders(self):
+        return self.__resp.getheaders()
+
+    def read(self, amt=None):
+        try:
+            data = self.__resp.read(amt)
+        except Exception:
+            self.__drop()
+            raise
+        if self.__resp.isclosed():
+            self.__release()
+        return data
+
+    def close(self):
+        """Close the response. The unread rest of body up to DRAIN_LIMIT
+        is read, the longer one drops the connection."""
+        if self.__conn is None:
+            return
+        rest = self.__resp.length
+        if not self.__resp.isclosed() and rest is not None and \
+                rest <= DRAIN_LIMIT:
+            try:
+                self.__resp.read()
+            except Exception:
+                self.__drop()
+                return
+        if self.__resp.isclosed():
+            self.__release()
+        else:
+            self.__drop()
+
+    def __release(self):
+        if self.__conn is None:
+            return
+        conn, self.__conn = self.__conn, None
+        if self.__resp.will_close:
+            self.__pool.discard(conn)
+        else:
+            self.__pool.put(self.__key, conn)
+
+    def __drop(self):
+        if self.__conn is None:
+            return
+        conn, self.__conn = self.__conn, None
+        self.__resp.close()
+        self.__pool.discard(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tp, val, tb):
+        self.close()
+
+
+class ConnectionPool:
+    "Thread safe keep-alive connections per (scheme, host, port)"
+    def __init__(self, size=4, idle=4., max_requests=100, timeout=60):
+        self.size = size
+        self.idle = idle
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.context = ssl.create_default_context()
+        self.__sessions = {}
+        self.__idle = {}
+        self.__counters = {}
+        self.__proxies = {}
+        self.__lock = Lock()
+        self.stats = {"connects": 0, "reuses": 0, "retries": 0,
+                      "evicted": 0}
+
+    def get(self, key, max_idle=None):
+        """Get idle connection or make the new one. The connection idle
+        longer than max_idle is left for other requests."""
+        now = time()
+        stale = []
+        conn = None
+        with self.__lock:
+            idle = self.__idle.get(key, [])
+            while idle:
+                cand, since = idle[-1]
+                if now - since > self.idle:
+                    idle.pop()
+                    stale.append(cand)
+                    continue
+                if max_idle is None or now - since <= max_idle:
+                    idle.pop()
+                    conn = cand
+                break
+            self.stats["evicted"] += len(stale)
+            if conn is not None:
+                self.stats["reuses"] += 1
+            else:
+                self.stats["connects"] += 1
+        for i in stale:
+            self.discard(i)
+        if conn is not None:
+            return conn, True
+        scheme, host, port = key
+        proxy = self.proxy(key)
+        if proxy is not None:
+            conn_host, conn_port = proxy[:2]
+        else:
+            conn_host, conn_port = host, port
+        if scheme == "https":
+            conn = _HTTPSConnection(conn_host, conn_port, self.timeout,
+                                    self.context, self.__sessions)
+            if proxy is not None:
+                conn.set_tunnel(host, port, proxy[2])
+        else:
+            conn = HTTPConnection(conn_host, conn_port, timeout=self.timeout)
+        with self.__lock:
+            self.__counters[id(conn)] = 0
+        return conn, False
+
+    def put(self, key, conn):
+        "Return the connection with completely read response"
+        with self.__lock:
+            served = self.__counters.get(id(conn), 0)
+            idle = self.__idle.setdefault(key, [])
+            keep = served < self.max_requests and len(idle) < self.size
+            if keep:
+                idle.append((conn, time()))
+        if not keep:
+            self.discard(conn)
+
+    def discard(self, conn):
+        "Close the connection which is not returned into the pool"
+        with self.__lock:
+            self.__counters.pop(id(conn), None)
+        conn.close()
+
+    def __count(self, conn):
+        with self.__lock:
+            self.__counters[id(conn)] = self.__counters.get(id(conn), 0) + 1
+
+    def requests_served(self, conn):
+        with self.__lock:
+            return self.__counters.get(id(conn), 0)
+
+    def evict_idle(self):
+        "Close the connections idle for too long"
+        now = time()
+        stale = []
+        with self.__lock:
+            for key, idle in self.__idle.items():
+                fresh = [i for i in idle if now - i[1] <= self.idle]
+                stale.extend(i[0] for i in idle if now - i[1] > self.idle)
+                idle[:] = fresh
+            self.stats["evicted"] += len(stale)
+        for conn in stale:
+            self.discard(conn)
+
+    def clear(self):
+        with self.__lock:
+            conns = [i[0] for idle in self.__idle.values() for i in idle]
+            self.__idle.clear()
+        for conn in conns:
+            self.discard(conn)
+
+    def proxy(self, key):
+        """Host, port and headers of the proxy from the environment like
+        urlopen uses, None for the direct connection"""
+        with self.__lock:
+            if key in self.__proxies:
+                return self.__proxies[key]
+        scheme, host, port = key
+        url = getproxies().get(scheme)
+        proxy = None
+        if url and not proxy_bypass("%s:%d" % (host, port)):
+            if "://" not in url:
+                url = "http://" + url
+            parts = urlsplit(url)
+            headers = {}
+            if parts.username is not None:
+                auth = "%s:%s" % (unquote(parts.username),
+                                  unquote(parts.password or ""))
+                headers["Proxy-Authorization"] = "Basic " + b64encode(
+                    auth.encode()).decode()
+            proxy = (parts.hostname, parts.port or 80, headers)
+        with self.__lock:
+            self.__proxies[key] = proxy
+        return proxy
+
+    @staticmethod
+    def pool_key(url):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise URLError("unknown url type: %s" % scheme)
+        port = parts.port or (443 if scheme == "https" else 80)
+        return scheme, parts.hostname, port
+
+    def request(self, url, data=None, headers={}):
+        "Make request following redirects like urlopen does"
+        self.evict_idle()
+        method = "GET" if data is None else "POST"
+        for redirect in range(MAX_REDIRECTS):
+            resp = self.__request(method, url, data, headers)
+            code = resp.getcode()
+            location = resp.getheader("Location")
+            if code not in (301, 302, 303, 307, 308) or not location:
+                break
+            resp.read()
+            resp.close()
+            url = urljoin(url, location)
+            if code not in (307, 308):
+                method = "GET"
+                data = None
+                headers = dict((k, v) for k, v in headers.items()
+                               if k.lower() not in (
+                                   "content-type", "content-length"))
+        else:
+            raise URLError("too many redirects")
+        if code >= 400:
+            resp.read()
+            resp.close()
+            raise HTTPError(url, code, resp.reason, resp.getheaders(), None)
+        return resp
+
+    def __request(self, method, url, data, headers):
+        key = self.pool_key(url)
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        heads = dict(headers)
+        proxy = self.proxy(key)
+        if proxy is not None and key[0] == "http":
+            # the plain request is sent to the proxy with the full URL
+            path = parts._replace(fragment="").geturl()
+            heads.update(proxy[2])
+        if data is not None and not any(
+                k.lower() == "content-type" for k in heads):
+            heads["Content-Type"] = "application/x-www-form-urlencoded"
+        # the server may have done the request which has failed after
+        # it was sent, so only the idempotent one is sent again then
+        idempotent = method in IDEMPOTENT
+        while True:
+            conn, reused = self.get(
+                key, None if idempotent else FRESH_IDLE)
+            sent = False
+            try:
+                conn.request(method, path, data, heads)
+                sent = True
+                resp = conn.getresponse()
+            except STALE_ERRORS as err:
+                self.discard(conn)
+                if reused and (idempotent or not sent):
+                    with self.__lock:
+                        self.stats["retries"] += 1
+                    continue
+                if isinstance(err, OSError):
+                    raise URLError(err)
+                raise
+            except OSError as err:
+                self.discard(conn)
+                raise URLError(err)
+            except Exception:
+                self.discard(conn)
+                raise
+            self.__count(conn)
+            return PooledResponse(self, key, conn, resp, url)
@@ -14,19 +14,33 @@
 # limitations under the License.
 "Thread for dashboard's update"
 from traceback import print_exc
-from threading import Thread, Lock, active_count
+from threading import Lock, active_count
+from time import time
 from urllib.error import URLError
 from urllib.parse import urlsplit, parse_qs
 from .pgload import DashboardPage, LoginError
+from .msg_ldr import MessageLoader
 from .ptime import unix_time
+# unchanged dashboard still bumps the relevance of its tickets so often
+RESYNC_TIME = 3600
 
 
 class DashboardUpdater:
-    def __init__(self, core):
+    def __init__(self, core, msg_loader=None):
+        """msg_loader is the MessageLoader of the GUI, so the prefetched
+        articles of warmed up tickets are known to it"""
         self.__st_lock = Lock()
         self.__status = "Ready"
         self.__result = None
+        self.__unchanged = False
+        self.__synced = 0
+        self.__restored = False
         self.__page = DashboardPage(core)
+        self.__engine = core.call("engine")
+        if msg_loader is None:
+            msg_loader = MessageLoader(core)
+        self.__msg_loader = msg_loader
+        self.__session = core.call("session")
         self.__db = core.call("database")
         self.runtime = core.call("runtime cfg")
         self.core_cfg = core.call("core cfg")
@@ -42,21 +56,31 @@ class DashboardUpdater:
         self.__status = status
         self.__st_lock.release()
 
-    def start_loader(self, site):
+    def start_loader(self, site, callback=None):
+        "Load the dashboard, callback is called in GUI thread when done"
+        self.__restored = self.__session.restore()
+        if self.__restored:
+            site = site or self.runtime.get("site")
         self.__site = site
         self.__set_status("Wait")
         self.__result = None
-        t = Thread(target=self.__thr_loader)
-        t.daemon = True
-        t.start()
+        self.__start(callback)
 
-    def __thr_loader(self):
+    def __start(self, callback):
+        self.__engine.call(self.__loader, callback=(
+            None if callback is None else lambda fut: callback()))
+
+    def __loader(self):
         try:
             if self.__site is None:
                 pgl = self.__page.login(self.__who)
+            elif self.__session.expiring() and self.__credentials():
+                # renew the session before the server forgets it
+                pgl = self.__page.login(self.__credentials())
             else:
-                pgl = self.__page.load(self.__site)
+                pgl = self.__load_checked()
         except LoginError:
+            self.__session.forget()
             self.__set_status("LoginError")
             return
         except URLError as err:
@@ -69,11 +93,37 @@ class DashboardUpdater:
             self.__set_status("URLError")
             return
         self.__result = pgl
+        # the same body as before was not parsed again
+        self.__unchanged = self.__page.cached
         if pgl is None:
             self.__set_status("Empty")
         else:
+            self.__session.touch()
             self.__set_status("Complete")
 
+    def __load_checked(self):
+        """The first load checks the restored session, its title is
+        checked before the rest of the page is read. The refused session
+        is replaced by a fresh login at once."""
+        restored, self.__restored = self.__restored, False
+        try:
+            return self.__page.load(self.__site)
+        except LoginError:
+            who = self.__credentials() if restored else None
+            if who is None:
+                raise
+            self.__session.forget()
+            return self.__page.login(who)
+
+    def __credentials(self):
+        "Site, user and password known without asking the user"
+        who = {}
+        for i in ("site", "user", "password"):
+            who[i] = self.runtime.get(i, self.core_cfg.get(i, ""))
+        if not all(str(i) for i in who.values()):
+            return None
+        return who
+
     def get_result(self):
         if self.get_status() == "Wait":
             return
@@ -87,7 +137,8 @@ class DashboardUpdater:
         updlist = []
         for name in ("Reminder", "New", "Open"):
             for item in pgl[name]:
-                tid, = parse_qs(urlsplit(item["href"]).query)["TicketID"]
+                tid, = parse_qs(
+                    urlsplit(item["href"]).query.replace(";", "&"))["TicketID"]
                 tid = int(tid)
                 item["TicketID"] = tid
                 mtime = unix_time(item.get("Changed", ''),
@@ -95,11 +146,17 @@ class DashboardUpdater:
                 item["mtime"] = mtime
                 updlist.append((tid, int(item["number"]),
                                 mtime, item["title"]))
-        try:
-            renewed = self.__db.update_tickets(updlist)
-        except Exception as err:
-            print_exc()
-            return
+        if self.__unchanged and time() - self.__synced < RESYNC_TIME:
+            # database already has all of them
+            renewed = []
+        else:
+            try:
+                renewed = self.__db.update_tickets(updlist)
+            except Exception as err:
+                print_exc()
+                return
+            self.__synced = time()
+        self.__msg_loader.warm_up(renewed)
         summary = {"Important": set()}
         for name in ("Reminder", "New", "Open"):
             summary[name] = set()
@@ -115,13 +172,11 @@ class DashboardUpdater:
         self.runtime.update(pgl["inputs"])
         return result, summary
 
-    def login(self, who):
+    def login(self, who, callback=None):
         self.__who = who
         self.__site = None
         self.__set_status("Wait")
-        t = Thread(target=self.__thr_loader)
-        t.daemon = True
-        t.start()
+        self.__start(callback)
 
     def get_info(self):
         return "currently %d threads" % active_count()
@@ -14,22 +14,60 @@
 "Provide database operations"
 
 import atexit
+from contextlib import contextmanager
 from os import makedirs, name
 from os.path import isdir, expanduser, join
-from sqlite3 import connect, Error, sqlite_version_info
+from sqlite3 import connect, Error
+from threading import Lock, local
 from time import time
 ART_SEEN = 1 << 8
 ART_TEXT = 1 << 5
 ART_TYPE_MASK = 0xf
 TIC_SEEN = 1 << 8
 TIC_UPD = 1
-# TODO: escape more accurately sql datatypes
+# the least limit of host parameters in the statement of old sqlite
+MAX_VARIABLES = 999
+# the statements are reused by sqlite3 module while they are cached
+CACHED_STATEMENTS = 256
+# seconds the relevance of the unchanged dashboard's ticket may lag
+RELEVANCE_STEP = 3600
+# seconds to wait for the lock held by other connection
+BUSY_TIMEOUT = 10
+# settings of every connection, the WAL journal is kept by the file
+PRAGMAS = ("PRAGMA synchronous = NORMAL", "PRAGMA cache_size = -8192",
+           "PRAGMA mmap_size = %d" % (64 << 20), "PRAGMA temp_store = MEMORY")
+TABLES = (
+    ("tickets", "id INTEGER PRIMARY KEY, number INT, mtime INT, flags INT, "
+     "title VARCHAR, allow INT, info TEXT, relevance INT"),
+    ("articles", "id INTEGER PRIMARY KEY, ticket INT, ctime INT, "
+     "title VARCHAR, sender VARCHAR, reciever VARCHAR, flags INT, "
+     "message TEXT"),
+    ("allows", "id INTEGER PRIMARY KEY, value VARCHAR"))
 
 
-def sql_repr(x):
-    if x is None:
-        return "NULL"
-    return repr(x).replace("\\'", "''").replace("\\\\", "\\")
+def rekeyed(table, columns):
+    "Recreate the table with the keys, the later duplicates win"
+    return ("CREATE TABLE new_%s (%s)" % (table, columns),
+            "INSERT OR REPLACE INTO new_%s SELECT * FROM %s ORDER BY rowid"
+            % (table, table),
+            "DROP TABLE %s" % table,
+            "ALTER TABLE new_%s RENAME TO %s" % (table, table))
+
+
+# MIGRATIONS[i] upgrades the schema from user_version i to i + 1
+MIGRATIONS = (
+    # the tables of the first releases
+    ("CREATE TABLE IF NOT EXISTS tickets (id INT, number INT, mtime INT, "
+     "flags INT, title VARCHAR, allow INT, info TEXT, relevance INT)",
+     "CREATE TABLE IF NOT EXISTS articles (id INT, ticket INT, ctime INT, "
+     "title VARCHAR, sender VARCHAR, reciever VARCHAR, flags INT, "
+     "message TEXT)",
+     "CREATE TABLE IF NOT EXISTS allows (id INT, value VARCHAR)"),
+    rekeyed(*TABLES[0]) + rekeyed(*TABLES[1]) + rekeyed(*TABLES[2]) + (
+        "CREATE INDEX articles_ticket ON articles (ticket)",
+        "CREATE INDEX tickets_mtime ON tickets (mtime)",
+        "CREATE INDEX tickets_relevance ON tickets (relevance)",
+        "CREATE INDEX allows_value ON allows (value)"))
 
 
 class Database:
@@ -46,42 +84,114 @@ class Database:
             path = expanduser("~/otrs_us")
         if not isdir(path):
             makedirs(path)
-        path = join(path, filename)
-        self.connection = None
+        self.path = join(path, filename)
+        self.__local = local()
+        self.__connections = []
+        self.__lock = Lock()
         try:
-            self.connection = connect(path)
+            self.connection.execute("PRAGMA journal_mode = WAL")
         except Error as e:
+            self.close()
             return
-        tables = {
-            "tickets": "id INT, number INT, mtime INT, flags INT, "
-            "title VARCHAR, allow INT, info TEXT, relevance INT",
-            "articles": "id INT, ticket INT, ctime INT, title VARCHAR, "
-            "sender VARCHAR, reciever VARCHAR, flags INT, message TEXT",
-            "allows": "id INT, value VARCHAR"}
-        for table in tables:
-            self.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (
-                table, tables[table]))
+        self.migrate()
         if autoclose:
             atexit.register(self.close)
 
     def __bool__(self):
-        return self.connection is not None
+        return bool(self.__connections)
+
+    @property
+    def connection(self):
+        """Connection of the current thread. With WAL journal the readers
+        are not blocked by the writing thread."""
+        try:
+            return self.__local.connection
+        except AttributeError:
+            pass
+        # closed by close() from other thread
+        connection = connect(self.path, BUSY_TIMEOUT,
+                             cached_statements=CACHED_STATEMENTS,
+                             check_same_thread=False)
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        with self.__lock:
+            self.__connections.append(connection)
+        self.__local.connection = connection
+        return connection
 
-    def execute(self, command, commit=True):
+    def execute(self, command, params=(), commit=True):
+        "Execute the statement with bound parameters, return all rows"
         cursor = self.connection.cursor()
         try:
-            cursor.execute(command)
+            cursor.execute(command, params)
         except Error:
             raise Error(command)
-        if commit:
+        if commit and not self.in_transaction():
             self.connection.commit()
         return cursor.fetchall()
 
+    def migrate(self):
+        "Upgrade the schema of the database file to the current version"
+        version, = self.execute("PRAGMA user_version", commit=False)[0]
+        for version in range(version, len(MIGRATIONS)):
+            with self.transaction():
+                for command in MIGRATIONS[version]:
+                    self.execute(command)
+                self.execute("PRAGMA user_version = %d" % (version + 1))
+
+    def in_transaction(self):
+        "Is the current thread inside transaction() block"
+        return getattr(self.__local, "depth", 0) > 0
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Group the writes of the block into one transaction. Nested
+        blocks join the outer one, which commits at its end or rolls
+        back on exception. Immediate transaction takes the write lock at
+        once, so the rows read in it are not changed by other threads."""
+        state = self.__local
+        depth = getattr(state, "depth", 0)
+        if depth == 0 and not self.connection.in_transaction:
+            self.connection.execute(
+                "BEGIN IMMEDIATE" if immediate else "BEGIN")
+        state.depth = depth + 1
+        try:
+            yield self
+            if depth == 0:
+                self.connection.commit()
+        except BaseException:
+            if depth == 0:
+                self.connection.rollback()
+            raise
+        finally:
+            state.depth = depth
+
+    def rows_by_ids(self, command, ids):
+        """Rows of the command which has '%s' in place of the list of ids,
+        ids are passed by the parts small enough for any sqlite"""
+        rows = []
+        for pos in range(0, len(ids), MAX_VARIABLES):
+            part = ids[pos:pos + MAX_VARIABLES]
+            rows.extend(self.execute(
+                command % ", ".join("?" * len(part)), part, False))
+        return rows
+
+    def executemany(self, command, seq_of_params, commit=True):
+        "Execute the statement once prepared for every parameters' tuple"
+        cursor = self.connection.cursor()
+        try:
+            cursor.executemany(command, seq_of_params)
+        except Error:
+            raise Error(command)
+        if commit and not self.in_transaction():
+            self.connection.commit()
+        return cursor.rowcount
+
     def update_ticket(
             self, id, number=None, mtime=None, flags=None, title=None,
             info=None):
         tcts = self.execute("SELECT number, mtime, flags, title, info "
-                            "FROM tickets WHERE id=%d" % id, False)
+                            "FROM tickets WHERE id=?", (id,), False)
         if tcts:
             updict = {}
             dnum, dmtime, dflags, dtitle, dinfo = tcts[0]
@@ -92,52 +202,63 @@ class Database:
                             (info, dinfo, "info"),
                             (int(time()), 0, "relevance")):
                 if i is not None and i != j:
-                    updict[k] = sql_repr(i)
+                    updict[k] = i
             if updict:
-                upstr = ", ".join("%s=%s" % (i, updict[i]) for i in updict)
-                self.execute("UPDATE tickets SET %s "
-                             "WHERE id=%d" % (upstr, id))
+                upstr = ", ".join("%s=?" % i for i in updict)
+                self.execute("UPDATE tickets SET %s WHERE id=?" % upstr,
+                             tuple(updict.values()) + (id,))
             return None if mtime is None else dmtime < mtime
-        instup = tuple(j if i is None else sql_repr(i) for i, j in (
-            (id, id), (number, '0'), (mtime, '0'), (flags, '0'),
-            (title, "'No subj'"), (-1, 0), (info, "'()'"), (int(time()), 0)))
-        self.execute("INSERT INTO tickets "
-                     "VALUES(%s, %s, %s, %s, %s, %s, %s, %s)" % instup)
+        instup = tuple(j if i is None else i for i, j in (
+            (id, id), (number, 0), (mtime, 0), (flags, 0),
+            (title, "No subj"), (-1, 0), (info, "()"), (int(time()), 0)))
+        self.execute("INSERT INTO tickets VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+                     instup)
         return True
 
     def update_tickets(self, updlist):
-        sql = self.execute
-        sql("CREATE TEMPORARY TABLE IF NOT EXISTS "
-            "tmp_tickets(id INT, number INT, mtime INT, title VARCHAR)", False)
-        if sqlite_version_info >= (3, 7, 11):
-            rearr = ",".join(
-                "(%s)" % ",".join(map(sql_repr, i)) for i in updlist)
-            sql("INSERT INTO tmp_tickets VALUES %s" % rearr, False)
-        else:
-            for s in updlist:
-                sql("INSERT INTO tmp_tickets VALUES (%s)" %
-                    ",".join(map(sql_repr, s)), False)
-        updated = sql("SELECT t.id FROM tmp_tickets AS t LEFT JOIN tickets"
-                      " AS o ON t.id = o.id "
-                      "WHERE t.mtime > o.mtime OR o.mtime IS NULL", False)
-        sql("CREATE TEMPORARY TABLE IF NOT EXISTS "
-            "upd_tickets (id INT, number INT, mtime INT, flags INT, "
-            "title VARCHAR, allow INT, info TEXT, relevance INT)", False)
-        sql("INSERT INTO upd_tickets SELECT t.id, t.number, t.mtime, CASE WHEN"
-            " o.flags IS NULL THEN 0 WHEN o.mtime < t.mtime THEN o.flags & ~%d"
-            " ELSE o.flags END, t.title, o.allow, o.info, %d FROM tmp_tickets "
-            "AS t LEFT JOIN tickets AS o ON t.id = o.id "
-            % (TIC_UPD, int(time())), False)
-        sql("DROP TABLE tmp_tickets", False)
-        sql("DELETE FROM tickets WHERE id in (SELECT id FROM upd_tickets)",
-            False)
-        sql("INSERT INTO tickets SELECT * FROM upd_tickets", False)
-        sql("DROP TABLE upd_tickets")
-        return [i for i, in updated]
+        """Sync the (id, number, mtime, title) rows of the dashboard in one
+        pass. Only new and changed tickets are written, the relevance of
+        unchanged ones is bumped when it is older than RELEVANCE_STEP.
+        Return ids of the new and modified tickets."""
+        now = int(time())
+        renewed = []
+        inserts = []
+        updates = []
+        bumps = []
+        with self.transaction(True):
+            stored = {row[0]: row[1:] for row in self.rows_by_ids(
+                "SELECT id, number, mtime, title, relevance FROM tickets "
+                "WHERE id IN (%s)", [i[0] for i in updlist])}
+            for id, number, mtime, title in updlist:
+                if id not in stored:
+                    inserts.append((id, number, mtime, title, now))
+                    renewed.append(id)
+                elif stored[id][:3] != (number, mtime, title):
+                    omtime = stored[id][1]
+                    updates.append((number, mtime, title, mtime, TIC_UPD,
+                                    now, id))
+                    if omtime is None or omtime < mtime:
+                        renewed.append(id)
+                elif (stored[id][3] or 0) < now - RELEVANCE_STEP:
+                    bumps.append((now, id))
+                else:
+                    continue
+                stored[id] = number, mtime, title, now
+            self.executemany("INSERT INTO tickets "
+                             "VALUES(?, ?, ?, 0, ?, NULL, NULL, ?)", inserts)
+            # the right sides of SET see the old values of the row
+            self.executemany(
+                "UPDATE tickets SET number=?, mtime=?, title=?, "
+                "flags=CASE WHEN flags IS NULL THEN 0 WHEN mtime < ? "
+                "THEN flags & ~? ELSE flags END, relevance=? WHERE id=?",
+                updates)
+            self.executemany("UPDATE tickets SET relevance=? WHERE id=?",
+                             bumps)
+        return renewed
 
     def ticket_fields(self, id, *fields):
-        rval = self.execute("SELECT %s FROM tickets WHERE id=%d" %
-                            (", ".join(fields), id), False)
+        rval = self.execute("SELECT %s FROM tickets WHERE id=?" %
+                            ", ".join(fields), (id,), False)
         if rval:
             return rval[0]
 
@@ -145,67 +266,97 @@ class Database:
         if allows is None:
             rv = self.execute(
                 "SELECT value FROM allows WHERE id IN "
-                "(SELECT allow FROM tickets WHERE id=%d)" % id, False)
+                "(SELECT allow FROM tickets WHERE id=?)", (id,), False)
             if rv:
                 return rv[0][0]
             return
-        rv = self.execute("SELECT id FROM allows WHERE value=%s" %
-                          sql_repr(allows), False)
-        if rv:
-            rv = rv[0][0]
-        else:
-            rv = self.execute("SELECT COUNT() FROM allows", False)
-            rv = rv[0][0]
-            self.execute("INSERT INTO allows "
-                         "VALUES(%d, %s)" % (rv, sql_repr(allows)))
-        self.execute("UPDATE tickets SET allow=%d WHERE id=%d" % (rv, id))
+        with self.transaction():
+            rv = self.execute("SELECT id FROM allows WHERE value=?",
+                              (allows,))
+            if rv:
+                rv = rv[0][0]
+            else:
+                # the ids of the migrated table may be sparse
+                rv = self.execute("SELECT COALESCE(MAX(id) + 1, 0) "
+                                  "FROM allows")[0][0]
+                self.execute("INSERT INTO allows VALUES(?, ?)", (rv, allows))
+            self.execute("UPDATE tickets SET allow=? WHERE id=?", (rv, id))
         return rv
 
+    @staticmethod
+    def __merged_article(stored, ticket=None, flags=None):
+        "Stored description with the new ticket and the seen flag"
+        dticket, dctime, dtitle, dsender, dflags = stored
+        if ticket is not None:
+            dticket = ticket
+        if flags is not None:
+            dflags |= flags & ART_SEEN
+        return dticket, dctime, dtitle, dsender, dflags
+
     def article_description(self, id, ticket=None, ctime=None,
                             title=None, sender=None, flags=None):
         arts = self.execute("SELECT ticket, ctime, title, sender, flags "
-                            "FROM articles WHERE id=%d" % id)
+                            "FROM articles WHERE id=?", (id,))
         if arts:
-            dticket, dctime, dtitle, dsender, dflags = arts[0]
-            updates = {}
-            if ticket is not None and ticket != dticket:
-                dticket = ticket
-                updates["ticket"] = dticket
-            if flags is not None and (flags & ART_SEEN) > (dflags & ART_SEEN):
-                dflags |= ART_SEEN
-                updates["flags"] = dflags
-            if updates:
-                us = ", ".join("%s=%s" % i for i in updates.items())
-                self.execute("UPDATE articles SET %s WHERE id=%d" % (us, id))
-            return dticket, dctime, dtitle, dsender, dflags
+            stored = self.__merged_article(arts[0], ticket, flags)
+            if stored != arts[0]:
+                self.execute("UPDATE articles SET ticket=?, flags=? "
+                             "WHERE id=?", (stored[0], stored[4], id))
+            return stored
         if any(i is None for i in (ticket, ctime, title, sender, flags)):
             return
-        self.execute(
-            "INSERT INTO articles "
-            "VALUES(%d, %d, %d, %s, %s, '', %d, '')" % (
-                id, ticket, ctime, sql_repr(title), sql_repr(sender), flags))
+        self.execute("INSERT INTO articles VALUES(?, ?, ?, ?, ?, '', ?, '')",
+                     (id, ticket, ctime, title, sender, flags))
         return ticket, ctime, title, sender, flags
 
+    def article_descriptions(self, articles):
+        """article_description for many rows of (id, ticket, ctime, title,
+        sender, flags). Return {id: stored description}."""
+        inserts = []
+        updates = []
+        with self.transaction(True):
+            known = {row[0]: row[1:] for row in self.rows_by_ids(
+                "SELECT id, ticket, ctime, title, sender, flags FROM "
+                "articles WHERE id IN (%s)", [i[0] for i in articles])}
+            for id, ticket, ctime, title, sender, flags in articles:
+                if id not in known:
+                    known[id] = ticket, ctime, title, sender, flags
+                    inserts.append((id, ticket, ctime, title, sender, flags))
+                    continue
+                stored = self.__merged_article(known[id], ticket, flags)
+                if stored != known[id]:
+                    known[id] = stored
+                    updates.append((stored[0], stored[4], id))
+            self.executemany(
+                "INSERT INTO articles VALUES(?, ?, ?, ?, ?, '', ?, '')",
+                inserts)
+            self.executemany(
+                "UPDATE articles SET ticket=?, flags=? WHERE id=?", updates)
+        return {i[0]: known[i[0]] for i in articles}
+
     def articles_description(self, ticket):
         rval = self.execute("SELECT id, ticket, ctime, title, sender, flags "
-                            "FROM articles WHERE ticket=%d" % ticket, False)
+                            "FROM articles WHERE ticket=?", (ticket,), False)
         if rval:
             return rval
         return ()
 
     def article_message(self, id, message=None):
         if message is None:
-            arts = self.execute("SELECT message FROM articles "
-                                "WHERE id = %d" % id)
+            arts = self.execute("SELECT message FROM articles WHERE id=?",
+                                (id,))
             if not arts:
                 return
             return arts[0][0]
-        self.execute("UPDATE articles SET message = %s, flags = flags | %d "
-                     "WHERE id = %d" % (sql_repr(message), ART_TEXT, id))
+        self.execute("UPDATE articles SET message=?, flags=flags | ? "
+                     "WHERE id=?", (message, ART_TEXT, id))
 
     def close(self):
-        if self.connection:
-            self.connection.close()
+        with self.__lock:
+            connections, self.__connections = self.__connections, []
+        for connection in connections:
+            connection.close()
+        self.__local = local()
 
     def __enter__(self):
         return self
@@ -217,5 +368,6 @@ class Database:
         min_relevance = int(time() - still_relevant)
         self.execute(
             "DELETE FROM articles WHERE ticket in (SELECT id FROM tickets "
-            "WHERE relevance < %d)" % min_relevance)
-        self.execute("DELETE FROM tickets WHERE relevance<%d" % min_relevance)
+            "WHERE relevance < ?)", (min_relevance,))
+        self.execute("DELETE FROM tickets WHERE relevance < ?",
+                     (min_relevance,))
@@ -0,0 +1,138 @@
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"Background writer of the page dumps"
+
+import gzip
+import os
+import re
+from collections import deque
+from itertools import count
+from queue import Queue, Full
+from random import random
+from threading import Thread, Lock
+from time import strftime, time
+NAME_RE = re.compile(r"^\w+-[\w-]+-\d+-\d+\.html\.gz$")
+
+
+class DumpWriter:
+    """Writes the dumps of the loaded pages by the own thread. Files are
+    gzipped, the oldest ones are removed when the dumps are bigger than
+    max_bytes or older than max_age. rates is {class name: share of
+    the pages to dump}, 1 for the classes not listed."""
+    def __init__(self, path, classes, max_bytes=64 << 20, max_age=604800,
+                 rates={}, queue_size=32):
+        self.path = path
+        self.classes = set(classes)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.rates = dict(rates)
+        self.stats = {"written": 0, "dropped": 0, "removed": 0}
+        self.__queue = Queue(queue_size)
+        self.__counter = count()
+        self.__files = deque()
+        self.__size = 0
+        self.__thread = None
+        self.__lock = Lock()
+
+    def wants(self, cl_name):
+        "Should the page of this class be dumped this time"
+        if cl_name not in self.classes:
+            return False
+        return random() < self.rates.get(cl_name, 1.)
+
+    def write(self, cl_name, page, data):
+        "Queue the dump, drop it if the writer lags behind"
+        meta = ["URL:\t%s" % page.geturl(), "CODE:\t%d" % page.getcode()]
+        meta.extend("%s:\t%s" % header for header in page.getheaders())
+        with self.__lock:
+            if self.__thread is None:
+                self.__start()
+        try:
+            self.__queue.put_nowait((cl_name, meta, data))
+        except Full:
+            self.stats["dropped"] += 1
+
+    def __start(self):
+        self.__thread = Thread(target=self.__run, name="dump writer")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        self.__scan()
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            try:
+                self.__write(*item)
+                self.__expire()
+            except OSError as err:
+                print("OSError: {0}".format(err))
+
+    def __name(self, cl_name):
+        return "%s-%s-%d-%d.html.gz" % (
+            cl_name, strftime("%b_%d_%H-%M-%S"), os.getpid(),
+            next(self.__counter))
+
+    def __write(self, cl_name, meta, data):
+        fname = os.path.join(self.path, self.__name(cl_name))
+        with gzip.open(fname, "wb", 6) as fp:
+            fp.write(("\n".join(meta) + "\n\n").encode())
+            fp.write(data)
+        size = os.path.getsize(fname)
+        self.__files.append((time(), size, fname))
+        self.__size += size
+        self.stats["written"] += 1
+
+    def __scan(self):
+        "Take into account the dumps of the previous runs"
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        found = []
+        for name in names:
+            if not NAME_RE.match(name):
+                continue
+            fname = os.path.join(self.path, name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            found.append((st.st_mtime, st.st_size, fname))
+        found.sort()
+        self.__files.extend(found)
+        self.__size += sum(i[1] for i in found)
+        self.__expire()
+
+    def __expire(self):
+        old = time() - self.max_age
+        while self.__files and (self.__size > self.max_bytes or
+                                self.__files[0][0] < old):
+            mtime, size, fname = self.__files.popleft()
+            self.__size -= size
+            try:
+                os.remove(fname)
+                self.stats["removed"] += 1
+            except OSError:
+                pass
+
+    def close(self):
+        "Write the queued dumps and stop"
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        if thread is None:
+            return
+        self.__queue.put(None)
+        thread.join(5)
@@ -16,6 +16,8 @@
 from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from urllib.error import URLError
 from threading import Thread, Lock
+from functools import partial
+from time import time
 import re
 from .ptime import unix_time
 from .pgload import (
@@ -52,23 +54,23 @@ def article_by_url(url):
 
 
 def shrink_tupled_text(ttext):
-    if not ttext:
-        return
-    i = 0
-    item = ttext.pop(i)
-    prevt = () if item[1:] == ((),) else item[1:]
-    saved = [item[0]]
-    while i < len(ttext):
-        item = ttext.pop(i)
+    "Merge the adjacent fragments of the same tags in place"
+    result = []
+    parts = []
+    prevt = None
+    for item in ttext:
+        if not item[0]:
+            continue
         curt = () if item[1:] == ((),) else item[1:]
-        if prevt == curt:
-            saved.append(item[0])
-        else:
-            ttext.insert(i, (''.join(saved),) + prevt)
-            i += 1
+        if curt != prevt:
+            if parts:
+                result.append(("".join(parts),) + prevt)
+            parts = []
             prevt = curt
-            saved = [item[0]]
-    ttext.insert(i, (''.join(saved),) + prevt)
+        parts.append(item[0])
+    if parts:
+        result.append(("".join(parts),) + prevt)
+    ttext[:] = result
 
 
 class MessageLoader:
@@ -78,6 +80,9 @@ class MessageLoader:
         self.runtime = core.call("runtime cfg")
         self.cfg = core.call("core cfg")
         self.__db = core.call("database")
+        self.__engine = core.call("engine")
+        self.__prefetching = {}
+        self.__warming = {}
 
     def zoom_ticket(self, ticket_id, force_update=None):
         rv = self.__db.ticket_fields(ticket_id, "info", "flags")
@@ -88,13 +93,23 @@ class MessageLoader:
         if flags & TIC_UPD and not force_update:
             info = eval(info)
             allowed = eval(self.__db.ticket_allows(ticket_id))
-            return self.describe_articles(ticket_id), info, allowed
-        arts = self.__update_ticket(ticket_id)
-        info = eval(self.__db.ticket_fields(ticket_id, "info")[0])
-        allowed = eval(self.__db.ticket_allows(ticket_id))
+            arts = self.describe_articles(ticket_id)
+        else:
+            arts = self.__update_ticket(ticket_id)
+            info = eval(self.__db.ticket_fields(ticket_id, "info")[0])
+            allowed = eval(self.__db.ticket_allows(ticket_id))
+        if arts:
+            self.prefetch_articles(ticket_id, arts)
         return arts, info, allowed
 
     def __update_ticket(self, ticket_id):
+        page = self.load_ticket_page(ticket_id)
+        if page is None:
+            return
+        return self.__treat_ticket_page(ticket_id, page)
+
+    def load_ticket_page(self, ticket_id, relogin=True):
+        "Download the ticket's zoom page, safe to call from any thread"
         self.echo("Zoom ticket:", ticket_id)
         url_beg = urlsplit(self.runtime.get("site"))[:3]
         params = (("Action", "AgentTicketZoom"), ("TicketID", ticket_id))
@@ -104,8 +119,12 @@ class MessageLoader:
         try:
             page = pg.load(url)
         except LoginError:
+            if not relogin:
+                return
             page = pg.login(self.runtime)
         except ConnectionError:
+            if not relogin:
+                return
             try:
                 self.echo("Login in Tickets.load_ticket")
                 page = pg.login(self.runtime)
@@ -115,7 +134,36 @@ class MessageLoader:
             return
         if page is None:
             raise ConnectionError()
-        return self.__treat_ticket_page(ticket_id, page)
+        return page
+
+    def warm_up(self, tickets):
+        """Zoom the changed tickets and download their new articles in
+        background so they open from the local cache"""
+        workers = self.cfg.get("warmup_workers")
+        budget = self.cfg.get("warmup_budget")
+        if not workers or not budget:
+            return
+        for ticket_id in tickets:
+            if ticket_id in self.__warming:
+                continue
+            if budget <= 0:
+                break
+            budget -= 1
+            self.__warming[ticket_id] = self.__engine.call(
+                self.load_ticket_page, ticket_id, False,
+                limit=("warmup", workers),
+                callback=partial(self.__warmed, ticket_id))
+
+    def __warmed(self, ticket_id, fut):
+        self.__warming.pop(ticket_id, None)
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        page = fut.result()
+        if page is None:
+            return
+        arts = self.__treat_ticket_page(ticket_id, page)
+        if arts:
+            self.prefetch_articles(ticket_id, arts, True)
 
     def __treat_ticket_page(self, ticket_id, page):
         try:
@@ -130,22 +178,27 @@ class MessageLoader:
         allow = self.detect_allowed_actions(page.get("action_hrefs", []) +
                                             page.get("art_act_hrefs", []))
         info = repr(page.get("info", ()))
-        rv = self.__db.ticket_fields(ticket_id, "number", "title", "flags")
-        number, title, flags = rv if rv else None, None, 0
-        number = None if number else page.get("number")
-        title = None if title else page.get("title")
-        flags |= TIC_UPD
-        self.__db.update_ticket(ticket_id, number, None, flags, title, info)
-        self.__db.ticket_allows(ticket_id, allow)
-        return self.describe_articles(page["articles"])
+        with self.__db.transaction():
+            rv = self.__db.ticket_fields(
+                ticket_id, "number", "title", "flags")
+            number, title, flags = rv if rv else None, None, 0
+            number = None if number else page.get("number")
+            title = None if title else page.get("title")
+            flags |= TIC_UPD
+            self.__db.update_ticket(
+                ticket_id, number, None, flags, title, info)
+            self.__db.ticket_allows(ticket_id, allow)
+            return self.describe_articles(page["articles"])
 
     def describe_articles(self, articles):
         if isinstance(articles, int):
             articles = self.__db.articles_description(articles)
         description = {}
+        rows = []
         for item in articles:
             if isinstance(item, dict):
-                qd = dict(parse_qsl(urlsplit(item["article info"]).query))
+                qd = dict(parse_qsl(urlsplit(
+                    item["article info"]).query.replace(";", "&")))
                 ticket_id = int(qd["TicketID"])
                 article_id = int(qd["ArticleID"])
                 title = item["Subject"]
@@ -159,19 +212,44 @@ class MessageLoader:
                     flags = 0
                 if "UnreadArticles" not in rcs:
                     flags |= ART_SEEN
-                flags = self.__db.article_description(
-                    article_id, ticket_id, ctime, title, sender, flags)[4]
+                rows.append(
+                    (article_id, ticket_id, ctime, title, sender, flags))
             else:
                 article_id, ticket_id, ctime, title, sender, flags = item
             description[article_id] = {
                 "TicketID": ticket_id, "ctime": ctime,
                 "Title": title, "Sender": sender, "Flags": flags}
+        if rows:
+            stored = self.__db.article_descriptions(rows)
+            for article_id, descr in stored.items():
+                description[article_id]["Flags"] = descr[4]
         return description
 
     def zoom_article(self, ticket_id, article_id):
         art_descr = self.__db.article_description(article_id)
         if art_descr[4] & ART_TEXT:
             return eval(self.__db.article_message(article_id))
+        mail_text = None
+        prefetch = self.__prefetching.pop(article_id, None)
+        if prefetch is not None and prefetch[1].done():
+            if not prefetch[1].cancelled():
+                try:
+                    mail_text = prefetch[1].result()
+                except Exception as err:
+                    self.echo("Prefetch failed:", repr(err))
+        elif prefetch is not None:
+            # do not wait for the queue, the running download is joined
+            # by load_article
+            prefetch[1].cancel()
+        if mail_text is None:
+            mail_text = self.load_article(ticket_id, article_id)
+        if mail_text is None:
+            return
+        self.__db.article_message(article_id, repr(mail_text))
+        return mail_text
+
+    def load_article(self, ticket_id, article_id):
+        "Download the article's text, safe to call from any thread"
         self.echo("Zoom article:", ticket_id, article_id)
         url_beg = urlsplit(self.runtime.get("site"))[:3]
         params = (
@@ -180,6 +258,7 @@ class MessageLoader:
             ("OTRSAgentInterface", self.runtime["OTRSAgentInterface"]))
         url = urlunsplit(url_beg + (urlencode(params), ""))
         pg = TicketsPage(self.core)
+        pg.set_sections(("ArticleMailHeader", "ArticleMailContent"))
         page = pg.load(url)
         if page is None:
             return
@@ -199,9 +278,46 @@ class MessageLoader:
         for i in reversed(mail_header):
             mail_text.insert(0, ("%s\t%s\n" % i,))
         shrink_tupled_text(mail_text)
-        self.__db.article_message(article_id, repr(mail_text))
         return mail_text
 
+    def prefetch_articles(self, ticket_id, articles, background=False):
+        """Download not cached articles of the ticket in background.
+        Unread articles go first, then the newest ones. Prefetch for
+        the opened ticket cancels one for previously opened ticket."""
+        if background:
+            workers = self.cfg.get("warmup_workers")
+            limit = ("warmup", workers)
+        else:
+            workers = self.cfg.get("prefetch_workers")
+            limit = ("prefetch", workers)
+        if not workers:
+            return
+        for art_id, (tid, fut, bgr) in list(self.__prefetching.items()):
+            if not (background or bgr) and tid != ticket_id and fut.cancel():
+                del self.__prefetching[art_id]
+        order = sorted(
+            (i for i in articles
+             if not articles[i]["Flags"] & ART_TEXT and
+             i not in self.__prefetching),
+            key=lambda x: (bool(articles[x]["Flags"] & ART_SEEN),
+                           -articles[x]["ctime"]))
+        for art_id in order:
+            fut = self.__engine.call(
+                self.load_article, ticket_id, art_id, limit=limit,
+                callback=partial(self.__prefetched, art_id))
+            self.__prefetching[art_id] = (ticket_id, fut, background)
+
+    def __prefetched(self, article_id, fut):
+        prefetch = self.__prefetching.get(article_id)
+        if prefetch is None or prefetch[1] is not fut:
+            return
+        del self.__prefetching[article_id]
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        mail_text = fut.result()
+        if mail_text is not None:
+            self.__db.article_message(article_id, repr(mail_text))
+
     def extract_url(self, ticket_id, article_id):
         return "%s?Action=AgentTicketZoom;TicketID=%d#%d" % (
             self.runtime.get("site"), ticket_id, article_id)
@@ -214,7 +330,7 @@ class MessageLoader:
     def detect_allowed_actions(self, act_hrefs):
         allowed = {}
         for href in act_hrefs:
-            qd = dict(parse_qsl(urlsplit(href).query))
+            qd = dict(parse_qsl(urlsplit(href).query.replace(";", "&")))
             try:
                 allowed[qd["Action"]] = qd.get("Subaction", True)
             except KeyError:
@@ -262,12 +378,12 @@ class MessageLoader:
         params = [
             ("Action", "AgentTicketNote"), ("TicketID", ticket_id),
             ("ChallengeToken", self.runtime["ChallengeToken"])]
-        return self.__send_request_ap(params)
+        return self.__send_request_ap(params, ("inputs",))
 
     def load_owners_pattern(self, ticket_id):
         params = [
             ("Action", "AgentTicketOwner"), ("TicketID", ticket_id)]
-        return self.__send_request_ap(params)
+        return self.__send_request_ap(params, ("inputs",))
 
     def load_customers_pattern(self, ticket_id):
         params = [
@@ -277,7 +393,7 @@ class MessageLoader:
     def load_close_pattern(self, ticket_id):
         params = [
             ("Action", "AgentTicketClose"), ("TicketID", ticket_id)]
-        return self.__send_request_ap(params)
+        return self.__send_request_ap(params, ("inputs",))
 
     def load_forward_pattern(self, ticket_id, article_id):
         params = [
@@ -288,15 +404,19 @@ class MessageLoader:
     def load_merge_pattern(self, ticket_id):
         params = [
             ("Action", "AgentTicketMerge"), ("TicketID", ticket_id)]
-        return self.__send_request_ap(params)
+        return self.__send_request_ap(params, ("inputs",))
 
     def load_new_mail_pattern(self):
         params = [("Action", "AgentTicketEmail")]
         return self.__send_request_ap(params)
 
-    def __send_request_ap(self, params):
+    def __send_request_ap(self, params, sections=None):
+        """Load the form. The pages without customer selection need only
+        "inputs" section."""
         url = "%s?%s" % (self.runtime["site"], urlencode(params))
         pg = AnswerPage(self.core)
+        if sections is not None:
+            pg.set_sections(sections)
         return pg.load(url)
 
     def send_form(self, cfg, inputs):
@@ -304,10 +424,21 @@ class MessageLoader:
         url = self.runtime["site"]
         pg.send(url, [(i[0], cfg.get(i[0], ("", b""))) for i in inputs])
 
-    def download_file(self, url, downpath):
+    def download_file(self, url, downpath, progress=None, callback=None):
+        """Download in background. progress(done, total) and
+        callback(future) are called in GUI thread."""
         if url.startswith("/"):
             m = re.search(r"^https?://[^/]+", self.runtime["site"])
             url = m.group(0) + url
         fl = FileLoader(self.core)
         fl.set_save_path(downpath)
-        fl.load(url)
+        if progress is not None:
+            last = [0.]
+
+            def report(done, total):
+                now = time()
+                if now - last[0] >= .2 or done == total:
+                    last[0] = now
+                    self.__engine.handoff(progress, done, total)
+            fl.set_progress(report)
+        return self.__engine.call(fl.load, url, callback=callback)
@@ -13,36 +13,42 @@
 # limitations under the License.
 "Making the multipart form"
 
-from hashlib import sha1
-from base64 import b64encode
+from uuid import uuid4
 
 
-def dump_multipart_text(data):
-    bsum = sha1()
-    for item in data:
-        bsum.update(str(item[1]).encode())
-    boundary = b64encode(bsum.digest())[:-1]
-    result = []
-    for name, content in data:
-        result.append(b"--" + boundary)
-        if isinstance(content, str):
-            result.append((
-                'Content-Disposition: form-data; name="%s"' % name).encode())
-            result.append(b'')
-            result.append(content.encode())
-        elif isinstance(content, tuple):
-            result.append((
-                'Content-Disposition: form-data; name="%s";'
-                ' filename="%s"' % (name, content[0])).encode())
-            result.append(b'')
-            result.append(content[1])
-    result.append(b'--' + boundary + b'--')
-    result.append(b'')
-    contentType = "multipart/form-data; boundary=%s" % (boundary.decode())
-    try:
-        result = b'\r\n'.join(result)
-    except TypeError as err:
-        print(data)
-        raise TypeError(err)
-    headers = {'Content-type': contentType}
-    return result, headers
+class MultipartBody:
+    """Body of the multipart/form-data request. It is produced by chunks
+    and may be iterated again when the request is repeated. The content
+    is either str or (filename, bytes)."""
+    def __init__(self, data):
+        self.boundary = ("otrs_us" + uuid4().hex).encode()
+        self.parts = []
+        for name, content in data:
+            if isinstance(content, str):
+                disp = 'form-data; name="%s"' % name
+                body = content.encode()
+            elif isinstance(content, tuple):
+                disp = 'form-data; name="%s"; filename="%s"' % (
+                    name, content[0])
+                body = content[1]
+            else:
+                continue
+            head = b"--%s\r\nContent-Disposition: %s\r\n\r\n" % (
+                self.boundary, disp.encode())
+            self.parts.append((head, body))
+        self.tail = b"--%s--\r\n" % self.boundary
+
+    def __len__(self):
+        return sum(len(head) + len(body) + 2
+                   for head, body in self.parts) + len(self.tail)
+
+    def __iter__(self):
+        for head, body in self.parts:
+            yield head
+            yield body
+            yield b"\r\n"
+        yield self.tail
+
+    def headers(self):
+        return {"Content-Type": "multipart/form-data; boundary=%s" %
+                self.boundary.decode(), "Content-Length": str(len(self))}
@@ -86,11 +86,21 @@ SPEC_ENTS = {
     "diams": "\u2666", "lt": "<", "gt": ">", "amp": "&"}
 
 
+def get_attr(attrs, name, default=None):
+    "Value of the attribute without making dict"
+    for key, value in attrs:
+        if key == name:
+            return value
+    return default
+
+
 class BasicParser(HTMLParser):
     "basic parser class"
     def __init__(self):
         HTMLParser.__init__(self)
         self.data_handler = None
+        # the needed part of the page was parsed, the rest may be skipped
+        self.done = False
 
     def handle_data(self, data):
         if self.data_handler is not None:
@@ -13,10 +13,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 "parse dashboard page"
-from . import BasicParser
+import re
+from . import BasicParser, get_attr
+WIDGETS = {
+    "Dashboard0120-TicketNew": "New",
+    "Dashboard0130-TicketOpen": "Open",
+    "Dashboard0100-TicketPendingReminder": "Reminder"}
+# tags which matter outside the widgets and inside them
+SCAN_RE = re.compile(r"<(input\b|div\b|script\b|style\b|!--)", re.I)
+INSIDE_RE = re.compile(r"<(/?div\b|script\b|style\b|!--)", re.I)
+WIDGET_RE = re.compile(r"""\bid\s*=\s*["']?(%s)\b""" % "|".join(WIDGETS))
+CDATA_END_RE = {"script": re.compile(r"</script\s*>", re.I),
+                "style": re.compile(r"</style\s*>", re.I),
+                "!--": re.compile("-->")}
+# rest of the tag up to its '>', which may be in the quoted values
+TAG_END_RE = re.compile(r"""[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>""")
+# tag with unbalanced quote ends at the first '>' after so many chars
+MAX_TAG = 64 << 10
+
+
+def tag_end(text, pos):
+    "Position after the tag which name ends at pos or -1 if incomplete"
+    m = TAG_END_RE.match(text, pos)
+    if m is not None:
+        return m.end()
+    if len(text) - pos > MAX_TAG:
+        return text.find(">", pos) + 1 or -1
+    return -1
 
 
 class DashboardParser(BasicParser):
+    """Tags are dispatched by the table of handlers. Outside the ticket
+    widgets only div's ids and inputs are looked at."""
     def __init__(self):
         BasicParser.__init__(self)
         self.tickets = {"New": [], "Open": [], "Reminder": [], "inputs": {}}
@@ -25,54 +53,142 @@ class DashboardParser(BasicParser):
         self.importance = 0
         self.head_names = []
         self.cur_column = -1
+        self.depth = 0
+        # text not scanned yet and depth of divs in the scanned widget
+        self.pending = ""
+        self.scan_depth = 0
+        self.outside = {"div": self.start_div, "input": self.start_input}
+        self.inside = {
+            "div": self.start_div, "input": self.start_input,
+            "a": self.start_a, "span": self.start_span, "tr": self.start_tr,
+            "td": self.start_td, "th": self.start_th,
+            "thead": self.start_thead}
+        self.starts = self.outside
+        self.ends = {}
+        self.inside_ends = {
+            "div": self.end_div, "a": self.end_a, "tr": self.end_tr}
+
+    def feed(self, data):
+        """Only the widgets are passed to the HTML parser, the rest is
+        scanned for inputs and the widgets' beginning. The parser gets
+        the text cut after complete tags, so it never keeps a part."""
+        text = self.pending + data
+        pos = start = 0
+        cut = None
+        while True:
+            m = (INSIDE_RE if self.scan_depth else SCAN_RE).search(text, pos)
+            if m is None:
+                break
+            kind = m.group(1).lower()
+            if kind in CDATA_END_RE:
+                end = CDATA_END_RE[kind].search(text, m.end())
+                if end is None:
+                    cut = m.start()
+                    break
+                pos = end.end()
+                continue
+            end = tag_end(text, m.end())
+            if end < 0:
+                cut = m.start()
+                break
+            if self.scan_depth:
+                self.scan_depth += -1 if kind == "/div" else 1
+                if not self.scan_depth:
+                    BasicParser.feed(self, text[start:end])
+            elif kind == "input":
+                BasicParser.feed(self, text[m.start():end])
+            elif WIDGET_RE.search(text, m.end(), end):
+                self.scan_depth = 1
+                start = m.start()
+            pos = end
+        if self.scan_depth:
+            if cut is None:
+                cut = pos
+            BasicParser.feed(self, text[start:cut])
+        elif cut is None:
+            # keep the possible beginning of a tag
+            cut = text.rfind("<", max(pos, len(text) - 8))
+            if cut < 0:
+                cut = len(text)
+        self.pending = text[cut:]
+
+    def close(self):
+        if self.scan_depth:
+            # the page is cut inside the widget
+            BasicParser.feed(self, self.pending)
+        self.pending = ""
+        BasicParser.close(self)
 
     def handle_starttag(self, tag, attrs):
-        dattrs = dict(attrs)
-        if tag == "div":
-            div_id = dattrs.get("id")
-            if div_id == "Dashboard0120-TicketNew":
-                self.cur_array = self.tickets["New"]
-            if div_id == "Dashboard0130-TicketOpen":
-                self.cur_array = self.tickets["Open"]
-            if div_id == "Dashboard0100-TicketPendingReminder":
-                self.cur_array = self.tickets["Reminder"]
+        handler = self.starts.get(tag)
+        if handler is not None:
+            handler(attrs)
+
+    def handle_endtag(self, tag):
+        handler = self.ends.get(tag)
+        if handler is not None:
+            handler()
+
+    def start_div(self, attrs):
+        if self.cur_array is not None:
+            self.depth += 1
             if 0 <= self.cur_column < len(self.head_names):
                 cn = self.head_names[self.cur_column]
-                if cn is not None and "title" in dattrs:
-                    self.cur_append[cn] = dattrs["title"]
-            return
-        if tag == "a" and dattrs.get("class") == "AsBlock MasterActionLink":
-            self.cur_append.update((i, dattrs[i]) for i in ("href", "title"))
-            self.data_handler = []
-            return
-        if tag == "span":
-            cls = dattrs.get("class", "").split()
-            if "UnreadArticles" in cls:
-                self.importance = 3 if "Remarkable" in cls else 1
-            return
-        if tag == "input":
-            self.tickets["inputs"][dattrs.get("name")] = dattrs.get("value")
-        if tag == "tr":
+                if cn is not None:
+                    title = get_attr(attrs, "title")
+                    if title is not None:
+                        self.cur_append[cn] = title
+                return
+        name = WIDGETS.get(get_attr(attrs, "id"))
+        if name is not None:
+            self.cur_array = self.tickets[name]
+            self.depth = 1
+            self.starts = self.inside
+            self.ends = self.inside_ends
+
+    def end_div(self):
+        self.depth -= 1
+        if self.depth <= 0:
+            self.cur_array = None
             self.cur_column = -1
-            self.cur_append = {}
-            return
-        if tag == "td":
-            self.cur_column += 1
-            return
-        if tag == "th":
-            self.head_names.append(dattrs.get("data-column"))
-            return
-        if tag == "thead":
-            self.head_names = []
-            return
+            self.starts = self.outside
+            self.ends = {}
 
-    def handle_endtag(self, tag):
-        if tag == "a" and self.data_handler:
+    def start_input(self, attrs):
+        self.tickets["inputs"][get_attr(attrs, "name")] = get_attr(
+            attrs, "value")
+
+    def start_a(self, attrs):
+        if get_attr(attrs, "class") == "AsBlock MasterActionLink":
+            self.cur_append["href"] = get_attr(attrs, "href")
+            self.cur_append["title"] = get_attr(attrs, "title")
+            self.data_handler = []
+
+    def start_span(self, attrs):
+        cls = get_attr(attrs, "class", "")
+        if "UnreadArticles" in cls.split():
+            self.importance = 3 if "Remarkable" in cls.split() else 1
+
+    def start_tr(self, attrs):
+        self.cur_column = -1
+        self.cur_append = {}
+
+    def start_td(self, attrs):
+        self.cur_column += 1
+
+    def start_th(self, attrs):
+        self.head_names.append(get_attr(attrs, "data-column"))
+
+    def start_thead(self, attrs):
+        self.head_names = []
+
+    def end_a(self):
+        if self.data_handler:
             self.cur_append["number"] = "".join(self.data_handler)
             self.cur_append["marker"] = self.importance
             self.cur_array.append(self.cur_append)
             self.data_handler = None
             self.importance = 0
-            return
-        if tag == "tr":
-            self.cur_append = None
+
+    def end_tr(self):
+        self.cur_append = None
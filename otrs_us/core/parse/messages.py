@@ -13,10 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 "parse tickets page"
-from . import BasicParser
+import re
+from . import BasicParser, get_attr
+SPACES_RE = re.compile(r"\s+")
+CUSTOMER_RE = re.compile(
+    "Core\\.Agent\\.CustomerSearch\\.AddTicketCustomer"
+    "\\(\\s*'([^']+)',\\s*\"([^\"]+)\"\\s*\\)")
 
 
 class MessageParser(BasicParser):
+    """message_text is the list of (text,) or (text, tags) fragments,
+    the adjacent fragments of the same tags are merged as they come"""
     def __init__(self):
         BasicParser.__init__(self)
         self.message_text = []
@@ -24,35 +31,37 @@ class MessageParser(BasicParser):
         self.curtags = []
         self.preformatted = 0
         self.div_level = 0
+        self.run_tags = ()
+        self.run_parts = []
 
     def handle_starttag(self, tag, attrs):
         if tag == "body":
             del self.data_handler[:]
             del self.message_text[:]
             del self.curtags[:]
+            del self.run_parts[:]
             self.preformatted = 0
         self.append_msg_text()
-        dattrs = dict(attrs)
         if tag == "h1":
             self.curtags.append(tag)
             return
         if tag == "p":
-            self.message_text.append(("\n    ",))
+            self.add_text("\n    ")
             return
         if tag == "br":
-            self.message_text.append(("\n",))
+            self.add_text("\n")
             return
         if tag == "div":
             self.div_level += 1
-            self.message_text.append(("\n<div> == %d ==\n" % self.div_level,))
+            self.add_text("\n<div> == %d ==\n" % self.div_level)
             return
         if tag == "img":
-            self.message_text.append(
-                ("\n<img (%s)>\n" % dattrs.get("src", ""), ("h1",)))
+            self.add_text("\n<img (%s)>\n" % get_attr(attrs, "src", ""),
+                          ("h1",))
             return
         if tag == "a":
-            self.message_text.append(
-                ("\n<a href=\"%s\">\n" % dattrs.get("href", ""), ("h1",)))
+            self.add_text("\n<a href=\"%s\">\n" % get_attr(attrs, "href", ""),
+                          ("h1",))
             return
         if tag == "pre":
             self.preformatted += 1
@@ -63,34 +72,77 @@ class MessageParser(BasicParser):
         if self.curtags and tag == self.curtags[-1]:
             self.curtags.pop(-1)
         if tag == "div":
-            self.message_text.append(("\n</div> == %d ==\n" % self.div_level,))
+            self.add_text("\n</div> == %d ==\n" % self.div_level)
             self.div_level -= 1
             return
         if tag == "pre":
             self.preformatted -= 1
             return
 
+    def close(self):
+        BasicParser.close(self)
+        self.flush_text()
+
     def append_msg_text(self):
-        if self.preformatted:
-            self.message_text.append(
-                ("".join(self.data_handler), tuple(self.curtags)))
-        else:
-            tspl = "".join(["."] + self.data_handler + ["."]).split()
-            self.message_text.append(
-                (" ".join(tspl)[1:-1], tuple(self.curtags)))
+        "Move the collected data to the text"
+        if not self.data_handler:
+            return
+        text = "".join(self.data_handler)
         del self.data_handler[:]
+        if not self.preformatted:
+            text = SPACES_RE.sub(" ", text)
+        self.add_text(text, tuple(self.curtags))
+
+    def add_text(self, text, tags=()):
+        if not text:
+            return
+        if tags != self.run_tags:
+            self.flush_text()
+            self.run_tags = tags
+        self.run_parts.append(text)
+
+    def flush_text(self):
+        if self.run_parts:
+            text = "".join(self.run_parts)
+            del self.run_parts[:]
+            if self.run_tags:
+                self.message_text.append((text, self.run_tags))
+            else:
+                self.message_text.append((text,))
 
 
 class AnswerParser(BasicParser):
-    def __init__(self):
+    """sections are "inputs" (ready at the page's footer) and "customer"
+    (ready when the customer is found in the scripts)"""
+    def __init__(self, sections=("inputs", "customer")):
         BasicParser.__init__(self)
+        self.sections = set(sections)
         self.inputs = []
         self.cur_select = None
         self.cur_option = None
         self.error_msg = None
+        self.customer = None
+        self.script = None
+
+    def handle_data(self, data):
+        if self.script is not None:
+            self.script.append(data)
+            return
+        BasicParser.handle_data(self, data)
+
+    def section_done(self, name):
+        self.sections.discard(name)
+        self.done = not self.sections
 
     def handle_starttag(self, tag, attrs):
+        if tag == "script":
+            self.script = []
+            return
         dattrs = dict(attrs)
+        if tag == "div":
+            if dattrs.get("id") == "Footer":
+                self.section_done("inputs")
+            return
         if tag == "input":
             self.inputs.append(tuple(
                 dattrs.get(i) for i in ("name", "value")))
@@ -114,6 +166,14 @@ class AnswerParser(BasicParser):
             return
 
     def handle_endtag(self, tag):
+        if tag == "script":
+            if self.customer is None and self.script:
+                m = CUSTOMER_RE.search("".join(self.script))
+                if m:
+                    self.customer = m.groups()
+                    self.section_done("customer")
+            self.script = None
+            return
         if tag == "option":
             self.cur_select["values"].append(
                 (self.cur_option, "".join(self.data_handler)))
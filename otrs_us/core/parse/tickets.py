@@ -13,19 +13,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 "parse tickets page"
+from collections import Counter
 from . import BasicParser
 
 
+def class_key(cls):
+    "Single class or sorted tuple of the classes"
+    scls = cls.split()
+    try:
+        hcls, = scls
+    except ValueError:
+        hcls = tuple(sorted(scls))
+    return hcls
+
+
 class TicketsParser(BasicParser):
-    def __init__(self):
+    """sections are the class keys of the divs with the needed data,
+    the parser is done when all of them have ended"""
+    def __init__(self, sections=None):
         BasicParser.__init__(self)
+        self.sections = None if sections is None else set(sections)
         self.row = None
         self.td_class = None
         self.p_title = None
         self.in_table = False
         self.in_tbody = False
         self.p_value = False
-        self.div_classes = dict()
+        # stack of the open divs' class keys and how many of them
+        # have each key, a key is in context while its counter is set
+        self.div_stack = []
+        self.div_classes = Counter()
+        self.action_rows = 0
+        self.class_keys = {}
         self.art_ctrl_cls = tuple(sorted(("LightRow", "Bottom")))
         self.opt_val = None
         self.on_div_end = {"ArticleBody": self.stop_data_handling}
@@ -44,6 +63,37 @@ class TicketsParser(BasicParser):
     def stop_data_handling(self):
         self.data_handler = None
 
+    def push_div(self, cls):
+        if cls:
+            key = self.class_keys.get(cls)
+            if key is None:
+                key = self.class_keys[cls] = class_key(cls)
+            self.div_classes[key] += 1
+            if "ActionRow" in key:
+                self.action_rows += 1
+        else:
+            key = None
+        self.div_stack.append(key)
+
+    def pop_div(self):
+        if not self.div_stack:
+            return
+        key = self.div_stack.pop()
+        if key is None:
+            return
+        if "ActionRow" in key:
+            self.action_rows -= 1
+        div_cls = self.div_classes
+        div_cls[key] -= 1
+        if not div_cls[key]:
+            del div_cls[key]
+            handler = self.on_div_end.get(key)
+            if handler is not None:
+                handler()
+            if self.sections:
+                self.sections.discard(key)
+                self.done = not self.sections
+
     def handle_starttag(self, tag, attrs):
         dattrs = dict(attrs)
         div_cls = self.div_classes
@@ -69,16 +119,7 @@ class TicketsParser(BasicParser):
             return
         if tag == "div":
             cls = dattrs.get("class")
-            for k in div_cls:
-                div_cls[k] += 1
-            if cls:
-                scls = cls.split()
-                try:
-                    hcls, = scls
-                except ValueError:
-                    hcls = tuple(sorted(scls))
-                if hcls not in div_cls:
-                    div_cls[hcls] = 1
+            self.push_div(cls)
             if cls == "ArticleBody":
                 self.data_handler = self.message_text
             return
@@ -116,7 +157,7 @@ class TicketsParser(BasicParser):
         if tag == "option":
             if "selected" in dattrs:
                 if "ActionRow" in div_cls:
-                    self.selected[0] = dattrs["value"]
+                    self.queues[0] = dattrs["value"]
                 if self.art_ctrl_cls in div_cls:
                     self.answers[0] = dattrs["value"]
             self.opt_val = dattrs.get("value")
@@ -142,14 +183,7 @@ class TicketsParser(BasicParser):
             self.td_class = None
             return
         if tag == "div":
-            for k in list(div_cls):
-                div_cls[k] -= 1
-                if div_cls[k] == 0:
-                    del div_cls[k]
-                    try:
-                        self.on_div_end[k]()
-                    except KeyError:
-                        pass
+            self.pop_div()
             return
         if tag == "title" or (tag == "h2" and "WidgetSimple" in div_cls):
             self.info.append("".join(self.data_handler))
@@ -174,8 +208,7 @@ class TicketsParser(BasicParser):
             if "ArticleMailHeader" in div_cls:
                 self.mail_header.append((self.label, title))
         if tag == "option":
-            if "ActionRow" in div_cls or any(
-                    ["ActionRow" in i for i in div_cls]):
+            if self.action_rows:
                 self.queues[1].append(
                     (self.opt_val, "".join(self.data_handler)))
             if self.art_ctrl_cls in div_cls:
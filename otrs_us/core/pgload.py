@@ -13,63 +13,299 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 "Page loader parrent"
+import csv
 import os
 import re
-from time import strftime
+import pickle
+from codecs import getincrementaldecoder
+from hashlib import blake2b
 from urllib.parse import urlparse, parse_qsl, urlencode
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError
-from http.client import BadStatusLine
-from gzip import decompress
+from urllib.error import HTTPError, URLError
+from http.client import BadStatusLine, HTTPException
+from threading import Lock, Event
+from zlib import decompressobj, MAX_WBITS, error as ZlibError
 from .parse.dashboard import DashboardParser
 from .parse.tickets import TicketsParser
 from .parse.messages import MessageParser, AnswerParser
-from .multipart import dump_multipart_text
+from .multipart import MultipartBody
+CHUNK_SIZE = 1 << 16
 
 
 class LoginError(RuntimeError):
     pass
 
 
+class BodyDecoder:
+    "Incremental gzip/deflate decoder with bounded output chunks"
+    def __init__(self, encoding):
+        encoding = (encoding or "").strip().lower()
+        self.__raw_tried = encoding != "deflate"
+        if encoding == "gzip":
+            self.__dobj = decompressobj(16 + MAX_WBITS)
+        elif encoding == "deflate":
+            self.__dobj = decompressobj(MAX_WBITS)
+        else:
+            self.__dobj = None
+
+    def feed(self, data):
+        dobj = self.__dobj
+        if dobj is None:
+            if data:
+                yield data
+            return
+        try:
+            out = dobj.decompress(data, CHUNK_SIZE)
+        except ZlibError:
+            if self.__raw_tried:
+                raise
+            # some servers send raw deflate stream without zlib header
+            self.__raw_tried = True
+            self.__dobj = dobj = decompressobj(-MAX_WBITS)
+            out = dobj.decompress(data, CHUNK_SIZE)
+        self.__raw_tried = True
+        if out:
+            yield out
+        while dobj.unconsumed_tail:
+            out = dobj.decompress(dobj.unconsumed_tail, CHUNK_SIZE)
+            if out:
+                yield out
+
+    def flush(self):
+        if self.__dobj is not None:
+            out = self.__dobj.flush()
+            if out:
+                yield out
+
+
+class SingleFlight:
+    """Concurrent identical loads share one request and its result.
+    The caller which started the request gets the result itself,
+    the others get its copies."""
+    def __init__(self):
+        self.__lock = Lock()
+        self.__flights = {}
+        self.coalesced = 0
+
+    def run(self, key, func, *args):
+        with self.__lock:
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights[key] = {
+                    "event": Event(), "waiters": 0, "result": None,
+                    "error": None}
+            else:
+                flight["waiters"] += 1
+                self.coalesced += 1
+        if not leader:
+            return self.__follow(flight)
+        try:
+            result = func(*args)
+            with self.__lock:
+                del self.__flights[key]
+                waiters = flight["waiters"]
+            if waiters:
+                flight["result"] = pickle.dumps(result)
+            return result
+        except BaseException as err:
+            flight["error"] = err
+            with self.__lock:
+                if self.__flights.get(key) is flight:
+                    del self.__flights[key]
+            raise
+        finally:
+            flight["event"].set()
+
+    @staticmethod
+    def __follow(flight):
+        flight["event"].wait()
+        if flight["error"] is not None:
+            raise flight["error"]
+        return pickle.loads(flight["result"])
+
+
+def iter_body(page):
+    "Iterate decompressed chunks of the response body"
+    decoder = BodyDecoder(page.getheader("Content-Encoding"))
+    while True:
+        data = page.read(CHUNK_SIZE)
+        if not data:
+            break
+        yield from decoder.feed(data)
+    yield from decoder.flush()
+
+
+def iter_lines(chunks):
+    "Decoded lines with their ends, the line ends only at \\n"
+    decoder = getincrementaldecoder("utf-8")(errors="replace")
+    rest = ""
+    for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    rest += decoder.decode(b"", True)
+    if rest:
+        yield rest
+
+
+def parse_offloaded(page_class, data):
+    """Parse the page in the worker process. make_parser and parse_result
+    of the page class should not use the core."""
+    page = page_class.__new__(page_class)
+    return page.feed_parser(page.make_parser(), iter((data,)))
+
+
 class Page:
+    cacheable = False
+    # the same body is not parsed again, the whole body is buffered
+    memoize = False
+    coalesce = True
+    # parts of the page the parser should stop after, None for whole page
+    sections = None
+
     def __init__(self, core):
         self.core_cfg = core.call("core cfg")
         self.runt_cfg = core.call("runtime cfg")
         self.echo = core.echo
+        self.pool = core.call("connection pool")
+        self.cache = core.call("response cache")
+        self.memo = core.call("parse memo")
+        self.flights = core.call("single flight")
+        self.recorder = core.call("recorder")
+        self.session = core.call("session")
+        self.dumper = core.call("dump writer")
+        self.offload = core.call("parse offload")
+        self.cached = False
         self.last_url = ""
 
+    def make_parser(self):
+        "HTML parser for the page or None to handle whole body in parse()"
+        return None
+
+    def parse_result(self, parser):
+        "Extract the result from the fed parser"
+        return parser
+
     def parse(self, data):
         "Dummy method to be replaced"
+        if self.make_parser() is not None:
+            return self.parse_stream(iter((data,)))
         print(data)
 
+    def parse_stream(self, chunks):
+        """Feed the parser by chunks as they come from the socket. The
+        page bigger than offload's threshold is parsed by other process,
+        unless only some sections of it are needed."""
+        parser = self.make_parser()
+        if parser is None:
+            return self.parse(b"".join(chunks))
+        if self.offload.enabled() and self.sections is None:
+            head = []
+            size = 0
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size > self.offload.threshold:
+                    head.extend(chunks)
+                    return self.offload.run(
+                        parse_offloaded, type(self), b"".join(head))
+            chunks = iter(head)
+        return self.feed_parser(parser, chunks)
+
+    def feed_parser(self, parser, chunks):
+        decoder = getincrementaldecoder("utf-8")(errors="ignore")
+        for chunk in chunks:
+            parser.feed(decoder.decode(chunk))
+            if parser.done:
+                # the rest of the body is not read
+                break
+        else:
+            parser.feed(decoder.decode(b"", True))
+        parser.close()
+        return self.parse_result(parser)
+
+    def set_sections(self, sections):
+        "Parse only these sections of the page"
+        self.sections = frozenset(sections)
+
     def load(self, location, data=None, headers={}):
         if not location:
             raise LoginError()
+        # the followers of the flight do not run __load, but may login
         self.last_url = re.sub(r"https?:\/\/[^/]+", r"", location)
+        if not self.coalesce or not isinstance(data, (bytes, type(None))):
+            return self.__load(location, data, headers)
+        key = (type(self).__name__, location, data,
+               tuple(sorted(headers.items())), self.sections)
+        result, self.cached = self.flights.run(
+            key, self.__load_flight, location, data, headers)
+        return result
+
+    def __load_flight(self, location, data, headers):
+        return self.__load(location, data, headers), self.cached
+
+    def __load(self, location, data, headers):
         heads = {"Accept-Encoding": "gzip, deflate",
                  "User-Agent": self.core_cfg.get("User-Agent", "OTRS_US/0.0")}
         if "Cookies" in self.runt_cfg:
             heads["Cookie"] = self.runt_cfg["Cookies"]
+        self.cached = False
+        ckey = None
+        if self.cacheable and data is None:
+            ckey = (type(self).__name__, location, self.sections)
+            heads.update(self.cache.validators(ckey))
         heads.update(headers)
-        r = Request(location, data, headers=heads)
         try:
-            pg = urlopen(r, timeout=60)
+            pg = self.pool.request(location, data, heads)
         except HTTPError as err:
             self.echo("HTTP Error:", err.getcode())
             return
         except Exception as err:
             self.echo(repr(err))
             return
-        pd = pg.read()
-        if pg.getheader("Content-Encoding") == "gzip":
-            pd = decompress(pd)
-        self.dump_data(pg, pd)
-        if not self.check_login(pd.decode(errors="ignore")):
-            raise LoginError(r.get_full_url())
-        return self.parse(pd)
+        with pg:
+            if ckey is not None and pg.getcode() == 304:
+                pg.read()
+                try:
+                    result = self.cache.lookup(ckey)
+                except KeyError:
+                    # was evicted meanwhile, so request it unconditionally
+                    self.cache.discard(ckey)
+                    return self.__load(location, data, headers)
+                self.cached = True
+                return result
+            chunks = self.dumped(pg, iter_body(pg), (location, data, heads))
+            chunks = self.login_checked(chunks, location)
+            if ckey is None:
+                return self.parse_stream(chunks)
+            return self.parse_cached(ckey, pg, chunks)
+
+    def parse_cached(self, key, page, chunks):
+        """Parse the page and cache the result. The body of the memoized
+        page is buffered to look its digest up in the memo first."""
+        cl_name = type(self).__name__
+        if not self.memoize or self.sections is not None:
+            result = self.parse_stream(chunks)
+        else:
+            digest = blake2b(digest_size=16)
+            body = []
+            for chunk in chunks:
+                digest.update(chunk)
+                body.append(chunk)
+            try:
+                result = self.memo.lookup(cl_name, digest.digest())
+                self.cached = True
+            except KeyError:
+                result = self.parse_stream(iter(body))
+                self.memo.store(cl_name, digest.digest(), result)
+        self.cache.store(key, result, page.getheader("ETag"),
+                         page.getheader("Last-Modified"))
+        return result
 
     def login(self, who=None, req=None):
         "login and load"
+        self.cached = False
         if who is None:
             who = self.runt_cfg
         if req is None:
@@ -77,25 +313,26 @@ class Page:
         user = who["user"]
         passwd = str(who["password"])
         site = who["site"]
-        r = Request(
-            site, urlencode(
-                [("Action", "Login"), ("RequestedURL", req), ("Lang", "en"),
-                 ("TimeOffset", ""), ("User", user), ("Password", passwd),
-                 ("login", "Login")]).encode())
+        data = urlencode(
+            [("Action", "Login"), ("RequestedURL", req), ("Lang", "en"),
+             ("TimeOffset", ""), ("User", user), ("Password", passwd),
+             ("login", "Login")]).encode()
+        heads = {"Accept-Encoding": "gzip, deflate",
+                 "User-Agent": self.core_cfg.get("User-Agent", "OTRS_US/0.0")}
         try:
-            pg = urlopen(r, timeout=60)
+            pg = self.pool.request(site, data, heads)
         except BadStatusLine:
             raise LoginError("BadStatusLine")
-        pd = pg.read()
-        if pg.getheader("Content-Encoding") == "gzip":
-            pd = decompress(pd)
         m = re.search(r"OTRSAgentInterface=[^;&]+", pg.geturl())
         if m and m.group(0):
             self.runt_cfg["Cookies"] = m.group(0)
+            self.session.save(site, user)
         else:
             self.runt_cfg.pop("Cookies", None)
-        self.dump_data(pg, pd)
-        return self.parse(pd)
+            self.session.forget()
+        with pg:
+            return self.parse_stream(
+                self.dumped(pg, iter_body(pg), (site, data, heads)))
 
     def check_login(self, pd):
         for i in pd.splitlines():
@@ -103,46 +340,69 @@ class Page:
                 return False
         return True
 
-    def dump_data(self, page, data):
-        if "pg_dump_to" not in self.core_cfg:
-            return
-        try:
-            path = self.core_cfg["pg_dump_to"][0]
-        except Exception as err:
-            print("Exception: {0}".format(err))
-            return
-        classes = self.core_cfg["pg_dump_to"][1:]
-        cl_name = str(self.__hash__).split()[3]
-        if cl_name not in classes:
+    def login_checked(self, chunks, location):
+        "Check the page's title as soon as it has come"
+        head = []
+        size = 0
+        for chunk in chunks:
+            if head is None:
+                yield chunk
+                continue
+            head.append(chunk)
+            size += len(chunk)
+            if size < CHUNK_SIZE and b"</title>" not in chunk.lower():
+                continue
+            if not self.check_login(b"".join(head).decode(errors="ignore")):
+                raise LoginError(location)
+            yield from head
+            head = None
+        if head is not None:
+            if not self.check_login(b"".join(head).decode(errors="ignore")):
+                raise LoginError(location)
+            yield from head
+
+    def dumped(self, page, chunks, request=None):
+        "Pass chunks through keeping their copy for dump_data and recorder"
+        dump = self.dumper is not None and self.dumper.wants(
+            type(self).__name__)
+        record = self.recorder is not None and request is not None
+        if not dump and not record:
+            yield from chunks
             return
-        tdate = strftime("%b_%d_%H-%M-%S")
-        fname = "%s-%s.html" % (cl_name, tdate)
-        fname = os.path.join(path, fname)
+        copy = []
         try:
-            with open(fname, "wb") as fp:
-                fp.write(("URL:\t%s\n" % page.geturl()).encode())
-                fp.write(("CODE:\t%d\n" % page.getcode()).encode())
-                for header in page.getheaders():
-                    fp.write(("%s:\t%s\n" % header).encode())
-                fp.write(b"\n")
-                fp.write(data)
-        except OSError as err:
-            print("OSError: {0}".format(err))
+            for chunk in chunks:
+                copy.append(chunk)
+                yield chunk
+            if record:
+                self.recorder.record(request, page, b"".join(copy))
+        finally:
+            if dump:
+                self.dump_data(page, b"".join(copy))
+
+    def dump_data(self, page, data):
+        "Pass the page to the background dump writer"
+        self.dumper.write(type(self).__name__, page, data)
 
 
 class DashboardPage(Page):
-    def parse(self, data):
-        parser = DashboardParser()
-        parser.feed(data.decode(errors="ignore"))
-        parser.close()
+    cacheable = True
+    memoize = True
+
+    def make_parser(self):
+        return DashboardParser()
+
+    def parse_result(self, parser):
         return parser.tickets
 
 
 class TicketsPage(Page):
-    def parse(self, data):
-        parser = TicketsParser()
-        parser.feed(data.decode(errors="ignore"))
-        parser.close()
+    cacheable = True
+
+    def make_parser(self):
+        return TicketsParser(self.sections)
+
+    def parse_result(self, parser):
         res = {}
         for i in ("message_text", "articles", "info", "mail_header",
                   "action_hrefs", "queues", "mail_src", "art_act_hrefs",
@@ -178,10 +438,12 @@ class TicketsPage(Page):
 
 
 class MessagePage(Page):
-    def parse(self, data):
-        parser = MessageParser()
-        parser.feed(data.decode(errors="ignore"))
-        parser.close()
+    cacheable = True
+
+    def make_parser(self):
+        return MessageParser()
+
+    def parse_result(self, parser):
         if parser.message_text:
             return parser.message_text
         else:
@@ -189,17 +451,15 @@ class MessagePage(Page):
 
 
 class AnswerPage(Page):
-    def parse(self, data):
-        parser = AnswerParser()
-        parser.feed(data.decode(errors="ignore"))
-        parser.close()
+    def make_parser(self):
+        if self.sections is None:
+            return AnswerParser()
+        return AnswerParser(self.sections)
+
+    def parse_result(self, parser):
         inputs = parser.inputs
-        m = re.search("Core\\.Agent\\.CustomerSearch\\\
-.AddTicketCustomer\\(\s*\'([^\']+)\',\s*\"([^\"]+)\"\s*\\)", data.decode(
-            errors="ignore"))
-        if m:
-            nam = m.group(1)
-            val = m.group(2)
+        if parser.customer:
+            nam, val = parser.customer
             for i, j in enumerate(inputs):
                 if j[0] == nam:
                     inputs[i] = (nam, val)
@@ -212,13 +472,31 @@ class AnswerSender(Page):
     def parse(self, data):
         return
 
+    def parse_stream(self, chunks):
+        for chunk in chunks:
+            pass
+
     def send(self, location, data_list):
-        da, di = dump_multipart_text(data_list)
-        self.load(location, da, di)
+        body = MultipartBody(data_list)
+        self.load(location, body, body.headers())
+
+
+def pageable(query):
+    "Can LIMIT and OFFSET be appended to the SQL"
+    return re.match(r"select\b", query, re.I) is not None and \
+        re.search(r"\b(limit|offset|fetch|top)\b", query, re.I) is None
 
 
 class QuerySender(Page):
+    """Send SQL to AdminSelectBox and read the CSV result. Empty values
+    are None."""
+    def __init__(self, core):
+        Page.__init__(self, core)
+        self.__core = core
+        self.header = None
+
     def send(self, query, limit):
+        "List of the rows, the first one is the header"
         da = urlencode(
             [("ChallengeToken", self.runt_cfg.get("ChallengeToken")),
              ("Action", "AdminSelectBox"), ("Subaction", "Select"),
@@ -227,28 +505,154 @@ class QuerySender(Page):
         return self.load(self.runt_cfg.get("site"), da)
 
     def parse(self, data):
-        rest = []
-        for l in data.decode().splitlines():
-            resr = []
-            empt_i = True
-            for i in re.findall('"(?:[^"]|"")*"|,', l):
-                if i == ",":
-                    if not resr:
-                        resr.append(None)
-                    if empt_i:
-                        resr.append(None)
-                    empt_i = True
-                else:
-                    empt_i = False
-                    resr.append(i.replace('""', '"')[1:-1])
-            rest.append(tuple(resr))
-        return rest
+        return self.parse_stream(iter((data,)))
+
+    def parse_stream(self, chunks):
+        return [tuple(i or None for i in row)
+                for row in csv.reader(iter_lines(chunks))]
+
+    def rows(self, query, limit, page_size=0, keyset=None):
+        """Generator of at most limit rows of the result without the
+        header. With page_size the SELECT without its own row limit is
+        requested by pages of page_size rows, one after another. With
+        keyset=(column, index) the pages are selected by the column's
+        value instead of OFFSET, which does not rescan the skipped rows.
+        Other statements are sent as they are."""
+        query = query.strip().rstrip(";")
+        if not page_size or not pageable(query):
+            yield from self.__rows(self.__page(query, limit))
+            return
+        if keyset is not None:
+            pages = self.__keyset_rows(query, page_size, *keyset)
+        else:
+            pages = self.__offset_rows(query, page_size)
+        for rows in pages:
+            yield from rows[:limit]
+            limit -= len(rows)
+            if limit <= 0:
+                return
+
+    def __offset_rows(self, query, page_size):
+        offset = 0
+        while True:
+            rows = self.__rows(self.__page("%s LIMIT %d OFFSET %d" % (
+                query, page_size, offset), page_size))
+            yield rows
+            if len(rows) < page_size:
+                return
+            offset += page_size
+
+    def __keyset_rows(self, query, page_size, column, index):
+        last = None
+        while True:
+            sql = "SELECT * FROM (%s) AS q" % query
+            if last is not None:
+                if not re.match(r"-?\d+$", last):
+                    last = "'%s'" % last.replace("'", "''")
+                sql += " WHERE q.%s > %s" % (column, last)
+            rows = self.__rows(self.__page("%s ORDER BY q.%s LIMIT %d" % (
+                sql, column, page_size), page_size))
+            yield rows
+            if len(rows) < page_size or rows[-1][index] is None:
+                return
+            last = rows[-1][index]
+
+    def __page(self, query, page_size):
+        result = type(self)(self.__core).send(query, page_size)
+        if result is None:
+            raise URLError("AdminSelectBox has not answered")
+        return result
+
+    def __rows(self, result):
+        if result and self.header is None:
+            self.header = result[0]
+        return result[1:]
 
 
 class FileLoader(Page):
-    def parse(self, data):
-        fp = open(self.__save_path, 'wb')
-        fp.write(data)
+    """Download the file by chunks into the ".part" file which is renamed
+    when complete. The broken download is resumed by the Range request."""
+    coalesce = False
+    attempts = 5
+
+    def __init__(self, core):
+        Page.__init__(self, core)
+        self.__save_path = None
+        self.__progress = None
 
     def set_save_path(self, path):
         self.__save_path = path
+
+    def set_progress(self, func):
+        "func(done, total) is called after every chunk, total may be None"
+        self.__progress = func
+
+    def load(self, location, data=None, headers={}):
+        "Return the saved path or None"
+        if not location:
+            raise LoginError()
+        self.last_url = re.sub(r"https?:\/\/[^/]+", r"", location)
+        part = self.__save_path + ".part"
+        for attempt in range(self.attempts):
+            heads = {"Accept-Encoding": "identity",
+                     "User-Agent": self.core_cfg.get(
+                         "User-Agent", "OTRS_US/0.0")}
+            if "Cookies" in self.runt_cfg:
+                heads["Cookie"] = self.runt_cfg["Cookies"]
+            heads.update(headers)
+            try:
+                done = os.path.getsize(part)
+            except OSError:
+                done = 0
+            if done:
+                heads["Range"] = "bytes=%d-" % done
+            try:
+                pg = self.pool.request(location, data, heads)
+            except HTTPError as err:
+                self.echo("HTTP Error:", err.getcode())
+                if err.getcode() == 416 and done:
+                    # the part is not the beginning of this file
+                    os.remove(part)
+                    continue
+                return
+            except (URLError, OSError) as err:
+                self.echo(repr(err))
+                continue
+            with pg:
+                try:
+                    complete, done, total = self.__save(pg, part, done)
+                except (OSError, HTTPException) as err:
+                    self.echo(repr(err))
+                    continue
+            if complete:
+                os.replace(part, self.__save_path)
+                return self.__save_path
+
+    def __save(self, pg, part, done):
+        if pg.getcode() != 206:
+            # server has sent the whole file
+            done = 0
+        m = re.search(r"/(\d+)", pg.getheader("Content-Range") or "")
+        if m:
+            total = int(m.group(1))
+        elif pg.getheader("Content-Length"):
+            total = done + int(pg.getheader("Content-Length"))
+        else:
+            total = None
+        first = True
+        with open(part, "ab" if done else "wb") as fp:
+            while True:
+                chunk = pg.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if first and not done and "html" in (
+                        pg.getheader("Content-Type") or ""):
+                    if not self.check_login(
+                            chunk.decode(errors="ignore")):
+                        raise LoginError(pg.geturl())
+                first = False
+                fp.write(chunk)
+                done += len(chunk)
+                if self.__progress is not None:
+                    self.__progress(done, total)
+        return total is None or done >= total, done, total
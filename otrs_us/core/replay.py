@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"Record OTRS traffic and replay it by the local fake server"
+
+import json
+import re
+from gzip import compress
+from hashlib import sha1
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from threading import Lock
+from time import time
+from urllib.parse import urlsplit, unquote_plus, urlencode
+from zipfile import ZipFile, ZIP_DEFLATED
+from . import synth
+# parameters which differ from session to session
+VOLATILE = ("OTRSAgentInterface", "ChallengeToken")
+# parameters which are never written to the archive
+SECRET = VOLATILE + ("Password",)
+SECRET_RE = re.compile(r"((?:^|[?;&])(?:%s)=)([^;&#]+)" % "|".join(SECRET))
+REDACTED = "REDACTED"
+# headers of the stored response which the replay server sets itself
+HOP_HEADERS = ("content-encoding", "content-length", "transfer-encoding",
+               "connection", "keep-alive", "set-cookie")
+
+
+def split_params(query):
+    "Split OTRS query which may use both ';' and '&'"
+    params = []
+    for item in re.split("[;&]", query):
+        if not item:
+            continue
+        name, sep, value = item.partition("=")
+        params.append((unquote_plus(name), unquote_plus(value)))
+    return params
+
+
+def redact(text, found=None):
+    "Replace values of the secret parameters in URL or query"
+    def replace(m):
+        if found is not None:
+            found.add(m.group(2))
+        return m.group(1) + REDACTED
+    return SECRET_RE.sub(replace, text)
+
+
+def redact_query(query, found=None):
+    "Urlencoded query with redacted secrets, also in the nested URLs"
+    params = []
+    for name, value in split_params(query):
+        if name in SECRET:
+            if found is not None and value:
+                found.add(value)
+            value = REDACTED
+        params.append((name, redact(value, found)))
+    return urlencode(params)
+
+
+def normalize_query(query):
+    return "&".join("%s=%s" % (n, redact(v)) for n, v in sorted(
+        i for i in split_params(query) if i[0] not in SECRET))
+
+
+def normalize_url(url):
+    "Path with sorted query without session dependent parameters"
+    parts = urlsplit(url)
+    norm = parts.path or "/"
+    query = normalize_query(parts.query)
+    if query:
+        norm += "?" + query
+    return norm
+
+
+def request_key(method, url, body=None, content_type=""):
+    if not body:
+        sbody = ""
+    elif "urlencoded" in (content_type or "") or content_type is None:
+        sbody = normalize_query(body.decode(errors="ignore"))
+    else:
+        # multipart boundaries are random, so use only the size
+        sbody = "%d bytes" % len(body)
+    return "%s %s %s" % (method, normalize_url(url), sbody)
+
+
+class Archive:
+    """Zip archive with the request/response pairs. Every pair is
+    stored as NNNNNN.json with the metadata and NNNNNN.body with the
+    decompressed body."""
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.__lock = Lock()
+        self.__zip = ZipFile(path, mode, ZIP_DEFLATED)
+        self.__count = sum(1 for i in self.__zip.namelist()
+                           if i.endswith(".json"))
+
+    def __len__(self):
+        return self.__count
+
+    def append(self, meta, body):
+        with self.__lock:
+            name = "%06d" % self.__count
+            self.__zip.writestr(name + ".json", json.dumps(meta, indent=1))
+            self.__zip.writestr(name + ".body", body)
+            self.__count += 1
+
+    def __iter__(self):
+        for name in sorted(self.__zip.namelist()):
+            if not name.endswith(".json"):
+                continue
+            meta = json.loads(self.__zip.read(name).decode())
+            body = self.__zip.read(name[:-5] + ".body")
+            yield meta, body
+
+    def close(self):
+        with self.__lock:
+            self.__zip.close()
+
+
+class Recorder:
+    """Record the pages loaded by the Page instances. Password, session
+    and challenge token are redacted, also in the response body."""
+    def __init__(self, path):
+        self.archive = Archive(path, "a")
+
+    def record(self, request, page, body):
+        location, data, headers = request
+        if data is not None and not isinstance(data, bytes):
+            # streamed multipart body
+            data = b"".join(data)
+        if isinstance(data, bytes):
+            content_type = next((v for k, v in headers.items()
+                                 if k.lower() == "content-type"), None)
+        else:
+            data, content_type = None, None
+        secrets = set()
+        sbody = (data or b"").decode(errors="replace")
+        if "urlencoded" in (content_type or "") or content_type is None:
+            sbody = redact_query(sbody, secrets)
+        meta = {
+            "time": time(), "method": "GET" if data is None else "POST",
+            "url": redact(location, secrets),
+            "final_url": redact(page.geturl(), secrets),
+            "key": request_key("GET" if data is None else "POST",
+                               location, data, content_type),
+            "request_headers": sorted(
+                (k, v) for k, v in headers.items() if k.lower() != "cookie"),
+            "request_body": sbody,
+            "code": page.getcode(),
+            "headers": [(k, redact(v, secrets)) for k, v in page.getheaders()
+                        if k.lower() not in HOP_HEADERS]}
+        for secret in secrets:
+            if len(secret) > 3:
+                body = body.replace(secret.encode(), REDACTED.encode())
+        self.archive.append(meta, body)
+
+    def close(self):
+        self.archive.close()
+
+
+class FakeOTRS:
+    """Answers from the recorded archive, synthesizes the pages which
+    were not recorded"""
+    def __init__(self, archive=None, tickets=10, articles=10,
+                 message_size=4096, require_login=False):
+        self.tickets = tickets
+        self.articles = articles
+        self.message_size = message_size
+        self.require_login = require_login
+        self.sessions = set()
+        self.__lock = Lock()
+        self.__recorded = {}
+        self.__served = {}
+        if archive is not None:
+            for meta, body in Archive(archive):
+                self.__recorded.setdefault(meta["key"], []).append(
+                    (meta["code"], meta["headers"], body))
+
+    def respond(self, method, url, body, headers):
+        "Return code, headers and body of the response"
+        key = request_key(method, url, body, headers.get("Content-Type"))
+        with self.__lock:
+            answers = self.__recorded.get(key)
+            if answers:
+                # replay the recorded sequence, then repeat its last item
+                served = self.__served.get(key, 0)
+                self.__served[key] = served + 1
+                return answers[min(served, len(answers) - 1)]
+        return self.synthesize(method, url, body, headers)
+
+    def session_of(self, url, headers):
+        m = re.search("OTRSAgentInterface=([^;&]+)",
+                      url + ";" + headers.get("Cookie", ""))
+        if m:
+            return m.group(1)
+
+    def synthesize(self, method, url, body, headers):
+        parts = urlsplit(url)
+        params = dict(split_params(parts.query))
+        if body and "urlencoded" in headers.get("Content-Type", ""):
+            params.update(split_params(body.decode(errors="ignore")))
+        html = [("Content-Type", "text/html; charset=utf-8")]
+        action = params.get("Action", "AgentDashboard")
+        if action == "Login":
+            session = sha1(str(time()).encode()).hexdigest()
+            with self.__lock:
+                self.sessions.add(session)
+            requested = params.get("RequestedURL") or parts.path
+            sep = "&" if "?" in requested else "?"
+            return 302, [("Location", "%s%sOTRSAgentInterface=%s" % (
+                requested, sep, session))], b""
+        session = self.session_of(url, headers)
+        if self.require_login and session not in self.sessions:
+            return 200, html, synth.login_page()
+        if action == "AgentDashboard":
+            return 200, html, synth.dashboard_page(
+                self.tickets, session=session or "FakeSession")
+        if action == "AgentTicketZoom":
+            try:
+                ticket_id = int(params["TicketID"])
+            except (KeyError, ValueError):
+                return 404, html, b"No TicketID"
+            if params.get("Subaction") == "ArticleUpdate":
+                return 200, html, synth.article_page(
+                    ticket_id, int(params.get("ArticleID", 0)))
+            return 200, html, synth.ticket_page(ticket_id, self.articles)
+        if action == "AgentTicketAttachment":
+            return 200, html, synth.message_page(
+                self.message_size, int(params.get("ArticleID", 0)))
+        return 404, html, b"Not synthesized"
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def do_GET(self):
+        size = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(size) if size else None
+        code, headers, data = self.server.otrs.respond(
+            self.command, self.path, body, self.headers)
+        if "gzip" in (self.headers.get("Accept-Encoding") or "") and data:
+            data = compress(data, 1)
+            headers = headers + [("Content-Encoding", "gzip")]
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_POST = do_GET
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    "Local stand-in for the OTRS server"
+    daemon_threads = True
+
+    def __init__(self, otrs, port=0, verbose=False):
+        HTTPServer.__init__(self, ("127.0.0.1", port), ReplayHandler)
+        self.otrs = otrs
+        self.verbose = verbose
+
+    def site(self):
+        return "http://127.0.0.1:%d/otrs/index.pl" % self.server_address[1]
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Fake OTRS server")
+    parser.add_argument("-a", "--archive", help="recorded archive")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-t", "--tickets", type=int, default=10,
+                        help="tickets on the dashboard")
+    parser.add_argument("-n", "--articles", type=int, default=10,
+                        help="articles in every ticket")
+    parser.add_argument("-m", "--message-size", type=int, default=4096,
+                        help="size of article's HTML")
+    parser.add_argument("-l", "--require-login", action="store_true")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    otrs = FakeOTRS(args.archive, args.tickets, args.articles,
+                    args.message_size, args.require_login)
+    server = ReplayServer(otrs, args.port, args.verbose)
+    print("Serving at", server.site())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
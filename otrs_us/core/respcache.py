@@ -0,0 +1,160 @@
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"Cache of the parsed pages"
+
+import pickle
+from collections import OrderedDict
+from threading import Lock
+
+
+class ResponseCache:
+    """LRU cache of the parsed results bounded by their pickled size.
+    Entry keeps ETag and Last-Modified of the page."""
+    def __init__(self, max_bytes=16 << 20):
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def size(self):
+        return self.__size
+
+    def validators(self, key):
+        "Headers for the conditional request"
+        heads = {}
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+        if entry is None:
+            return heads
+        if entry["etag"]:
+            heads["If-None-Match"] = entry["etag"]
+        if entry["modified"]:
+            heads["If-Modified-Since"] = entry["modified"]
+        return heads
+
+    def lookup(self, key):
+        "Copy of the stored result, raise KeyError on miss"
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                raise KeyError(key)
+            self.__entries.move_to_end(key)
+            self.stats["hits"] += 1
+            data = entry["result"]
+        return pickle.loads(data)
+
+    def store(self, key, result, etag=None, modified=None):
+        """Store freshly parsed result. The result without validators is
+        never asked for, so it is not stored."""
+        if not etag and not modified:
+            self.discard(key)
+            return
+        try:
+            data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        if len(data) > self.max_bytes:
+            self.discard(key)
+            return
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__size -= len(old["result"])
+            self.__entries[key] = {
+                "etag": etag, "modified": modified, "result": data}
+            self.__size += len(data)
+            while self.__size > self.max_bytes:
+                okey, old = self.__entries.popitem(last=False)
+                self.__size -= len(old["result"])
+                self.stats["evictions"] += 1
+
+    def discard(self, key):
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__size -= len(old["result"])
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+
+
+class ParseMemo:
+    """LRU memo of the parsed results keyed by page class and digest of
+    the decompressed body, so the same body is never parsed twice.
+    Bounded by number of entries and by their pickled size."""
+    def __init__(self, max_entries=64, max_bytes=8 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0,
+                      "evicted_bytes": 0}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def size(self):
+        return self.__size
+
+    def lookup(self, cl_name, digest):
+        "Copy of the stored result, raise KeyError on miss"
+        key = (cl_name, digest)
+        with self.__lock:
+            data = self.__entries.get(key)
+            if data is None:
+                self.stats["misses"] += 1
+                raise KeyError(key)
+            self.__entries.move_to_end(key)
+            self.stats["hits"] += 1
+        return pickle.loads(data)
+
+    def store(self, cl_name, digest, result):
+        try:
+            data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        if len(data) > self.max_bytes:
+            return
+        key = (cl_name, digest)
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__size -= len(old)
+            self.__entries[key] = data
+            self.__size += len(data)
+            while self.__size > self.max_bytes or \
+                    len(self.__entries) > self.max_entries:
+                okey, old = self.__entries.popitem(last=False)
+                self.__size -= len(old)
+                self.stats["evictions"] += 1
+                self.stats["evicted_bytes"] += len(old)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
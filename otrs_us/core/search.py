@@ -14,7 +14,7 @@
 # limitations under the License.
 "Searcher"
 import re
-from threading import Thread, Lock
+from threading import Lock
 from time import time
 from urllib.error import URLError
 from .ptime import TimeUnit, unix_time
@@ -26,6 +26,7 @@ class Searcher:
         self.__st_lock = Lock()
         self.__db = core.call("database")
         self.__core = core
+        self.__engine = core.call("engine")
         self.__status = "Ready"
         self.__result = None
         self.regexp = ""
@@ -47,14 +48,15 @@ class Searcher:
         self.__set_status("Ready")
         return res
 
-    def search(self, query):
+    def search(self, query, callback=None):
+        "Search, callback is called in GUI thread after external query"
         if self.get_status() != "Ready":
             return
         self.__set_status("Wait")
         if query.startswith(">"):
-            t = Thread(target=self.external_db_query, args=(query[1:],))
-            t.daemon = True
-            t.start()
+            self.__engine.call(
+                self.external_db_query, query[1:], callback=(
+                    None if callback is None else lambda fut: callback()))
             return
         if ":" in query:
             return self.db_by_time(query)
@@ -81,8 +83,7 @@ class Searcher:
             st, en = en, st
         for tid, num, tit, mt in self.__db.execute(
                 "SELECT id, number, title, mtime FROM tickets "
-                "WHERE %s BETWEEN %d AND %d" % (
-                    totime, st, en)):
+                "WHERE %s BETWEEN ? AND ?" % totime, (st, en)):
             result.append({
                 "number": num, "TicketID": tid, "title": tit,
                 "mtime": mt, "articles": ()})
@@ -92,22 +93,24 @@ class Searcher:
     def db_keywords(self, query):
         sql = self.__db.execute
         result = []
-        sre = "%".join(query.replace("'", "''").split())
+        sre = "%".join(query.split())
         self.regexp = pre = "\\W+".join(query.split())
         sql("CREATE TEMPORARY TABLE artsfound (id INT, ticket INT, msg TEXT)")
         sql("INSERT INTO artsfound SELECT id, ticket, message AS msg "
-            "FROM articles WHERE message LIKE '%%%s%%'" % sre)
-        for aid, in sql("SELECT id FROM artsfound", False):
-            msg = sql("select msg from artsfound where id=%d" % aid)[0][0]
+            "FROM articles WHERE message LIKE ?", ("%" + sre + "%",))
+        for aid, in sql("SELECT id FROM artsfound", commit=False):
+            msg = sql("select msg from artsfound where id=?", (aid,))[0][0]
             m = re.search(pre, msg, re.I)
             if m is None:
-                sql("DELETE FROM artsfound where id=%d" % aid)
-        for tid, in sql("SELECT DISTINCT ticket FROM artsfound", False):
-            arts = sql("SELECT id FROM artsfound WHERE ticket=%d" % tid, False)
+                sql("DELETE FROM artsfound where id=?", (aid,))
+        for tid, in sql("SELECT DISTINCT ticket FROM artsfound",
+                        commit=False):
+            arts = sql("SELECT id FROM artsfound WHERE ticket=?", (tid,),
+                       False)
             arts = set(list(zip(*arts))[0])
             num, tit, mt = sql(
                 "SELECT number, title, mtime FROM tickets "
-                "WHERE id=%d" % tid, False)[0]
+                "WHERE id=?", (tid,), False)[0]
             result.append({
                 "number": num, "TicketID": tid, "title": tit,
                 "mtime": mt, "articles": arts})
@@ -130,9 +133,11 @@ class Searcher:
             group by t.id ORDER BY t.change_time DESC""" % sre
         self.__core.echo("SQL Query is:\t", db_query)
         qs = QuerySender(self.__core)
+        cfg = self.__core.call("core cfg")
         result = []
         try:
-            for tn, tid, title, mt, arts in qs.send(db_query, 100)[1:]:
+            for tn, tid, title, mt, arts in qs.rows(
+                    db_query, cfg["query_limit"], cfg["query_page"]):
                 arts = set(map(int, arts.split(","))) if arts else ()
                 result.append({
                     "number": int(tn), "TicketID": int(tid), "title": title,
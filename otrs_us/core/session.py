@@ -0,0 +1,102 @@
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"OTRS session kept between the runs"
+
+from threading import Lock
+from time import time
+
+
+class SessionKeeper:
+    """Keeps the OTRSAgentInterface cookie in the core config encrypted
+    by the password's passphrase. The stored line is
+    site, user, cookie, login time and time of the last use."""
+    def __init__(self, core_cfg, runt_cfg):
+        self.core_cfg = core_cfg
+        self.runt_cfg = runt_cfg
+        self.created = None
+        self.used = None
+        self.__tried = False
+        self.__lock = Lock()
+
+    def restore(self):
+        """Put the saved session into runtime config if it is still
+        alive. Tried only once per run."""
+        with self.__lock:
+            if self.__tried or "Cookies" in self.runt_cfg:
+                return False
+            passwd = self.core_cfg.get("password")
+            secret = self.core_cfg.get("session")
+            if passwd is None or secret is None or \
+                    passwd.require_passphrse():
+                return False
+            self.__tried = True
+            secret.follow(passwd)
+            fields = str(secret).split("\t")
+            if len(fields) != 5:
+                return False
+            site, user, cookie, created, used = fields
+            try:
+                created, used = float(created), float(used)
+            except ValueError:
+                return False
+            now = time()
+            if now - created > self.lifetime() or \
+                    now - used > self.core_cfg["session_idle"]:
+                self.forget()
+                return False
+            for name, value in (("site", site), ("user", user)):
+                if self.runt_cfg.setdefault(name, value) != value:
+                    return False
+            self.runt_cfg["Cookies"] = cookie
+            self.created, self.used = created, used
+            return True
+
+    def lifetime(self):
+        return self.core_cfg["session_lifetime"]
+
+    def expiring(self):
+        "The session should be renewed"
+        if self.created is None:
+            return False
+        return time() - self.created > self.lifetime() * .9
+
+    def save(self, site, user):
+        "Remember the cookie of the fresh login"
+        self.created = self.used = time()
+        self.__tried = True
+        self.__store(site, user)
+
+    def touch(self):
+        "The session was used successfully"
+        if self.created is None:
+            return
+        self.used = time()
+        self.__store(self.runt_cfg.get("site", ""),
+                     self.runt_cfg.get("user", ""))
+
+    def __store(self, site, user):
+        cookie = self.runt_cfg.get("Cookies")
+        passwd = self.core_cfg.get("password")
+        if not cookie or passwd is None or \
+                not self.core_cfg.get("keep_session", True):
+            self.forget()
+            return
+        secret = passwd.derive("\t".join((
+            site, user, cookie, "%d" % self.created, "%d" % self.used)))
+        if secret is not None:
+            self.core_cfg["session"] = secret
+
+    def forget(self):
+        self.created = self.used = None
+        self.core_cfg.pop("session", None)
@@ -24,6 +24,9 @@ from hashlib import md5
 from sys import version
 from base64 import b64encode, b64decode
 
+# the length byte which starts a long AES encrypted value
+LONG_MARK = 0xff
+
 
 class Config(dict):
     def __init__(self, filename):
@@ -93,25 +96,58 @@ class Password:
     def encrypt_AES(self):
         lep = self.__plain.encode()
         lp = len(lep)
-        lep = eval("b'\\x%02x'" % lp) + lep + self.__hash[(lp + 1) % 16:]
+        if lp < LONG_MARK:
+            head = bytes((lp,))
+        else:
+            # longer values are marked and keep a 4 bytes length
+            head = bytes((LONG_MARK,)) + lp.to_bytes(4, "big")
+        lep = head + lep + self.__hash[(len(head) + lp) % 16:]
         coder = AES.new(self.__hash)
         return coder.encrypt(lep)
 
     def decrypt_AES(self, crypted):
         coder = AES.new(self.__hash)
         lep = coder.decrypt(crypted)
-        lp = lep[0]
-        if lp >= len(crypted):
+        if lep[0] == LONG_MARK:
+            ds = self.__unpadded(lep, 5, int.from_bytes(lep[1:5], "big"))
+            if ds is not None:
+                return ds
+        return self.__unpadded(lep, 1, lep[0])
+
+    def __unpadded(self, lep, head, lp):
+        if head + lp >= len(lep):
             return None
-        if self.__hash.endswith(lep[1 + lp:]):
-            return lep[1:1 + lp]
+        if self.__hash.endswith(lep[head + lp:]):
+            return lep[head:head + lp]
         return None
 
     def require_passphrse(self):
         return self.__passphrased and self.__plain is None
 
     def try_passphrase(self, passphrase):
-        self.__hash = md5(passphrase.encode()).digest()
+        self.__try_hash(md5(passphrase.encode()).digest())
+
+    def follow(self, master):
+        "Decrypt using the passphrase entered for the master password"
+        if self.__passphrased and self.__plain is None:
+            self.__try_hash(master.__hash)
+
+    def derive(self, plain):
+        "New secret protected the same way as this password"
+        if self.require_passphrse():
+            return None
+        secret = Password("")
+        secret.__passphrased = self.__passphrased
+        if self.__passphrased:
+            secret.__hash = self.__hash
+        secret.__plain = plain
+        return secret
+
+    def __try_hash(self, phash):
+        self.__hash = phash
+        if phash is None:
+            self.__plain = None
+            return
         if AES is None:
             ds = self.decrypt_xor(self.__epassword)
         else:
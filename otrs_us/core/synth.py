@@ -0,0 +1,264 @@
+# Copyright 2016 Serhiy Lysovenko
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"Synthesize OTRS-like pages of any size"
+
+from html import escape
+from random import Random
+from time import localtime, strftime, time
+WIDGETS = (("Reminder", "Dashboard0100-TicketPendingReminder"),
+           ("New", "Dashboard0120-TicketNew"),
+           ("Open", "Dashboard0130-TicketOpen"))
+WORDS = (
+    "printer", "server", "password", "reset", "mail", "queue", "invoice",
+    "network", "down", "request", "access", "VPN", "license", "urgent",
+    "update", "backup", "failed", "account", "locked", "monitor", "please",
+    "help", "error", "report", "disk", "full", "slow", "login", "new",
+    "user")
+SENDERS = ("agent-email-external", "customer-email-external",
+           "agent-note-internal", "system-email-notification-ext")
+BASE = "/otrs/index.pl?"
+
+
+def _words(rnd, count):
+    return " ".join(rnd.choice(WORDS) for i in range(count))
+
+
+def ticket_number(ticket_id):
+    return 2016010110000000 + ticket_id
+
+
+def ticket_title(ticket_id):
+    return _words(Random(ticket_id), 5).capitalize()
+
+
+def ticket_mtime(ticket_id, now=None):
+    if now is None:
+        now = time()
+    return int(now) - (ticket_id * 7919) % 864000
+
+
+def dashboard_page(tickets=10, challenge="FakeChallenge",
+                   session="FakeSession", now=None, first_id=1):
+    "Dashboard with the tickets spread among three widgets"
+    out = ['<!DOCTYPE html>\n<html><head><title>Dashboard - OTRS</title>'
+           '</head>\n<body class="Dashboard">\n<form action="/otrs/index.pl"'
+           ' method="get"><input type="hidden" name="ChallengeToken" value='
+           '"%s"/><input type="hidden" name="OTRSAgentInterface" value="%s"'
+           '/></form>\n' % (challenge, session)]
+    per_widget = [tickets // 3 + (1 if i < tickets % 3 else 0)
+                  for i in range(3)]
+    tid = first_id
+    for (name, div_id), count in zip(WIDGETS, per_widget):
+        out.append(
+            '<div id="%s" class="WidgetSimple CanDrag">\n<div class="Header">'
+            '<h2>%s</h2></div>\n<div class="Content"><table class="DataTab'
+            'le"><thead><tr><th data-column="Unread"></th><th data-column="'
+            'TicketNumber">Ticket#</th><th data-column="Changed">Changed</th>'
+            '<th data-column="Owner">Owner</th><th data-column="Title">Title'
+            '</th></tr></thead>\n<tbody>\n' % (div_id, name))
+        for i in range(count):
+            mark = ('<span class="UnreadArticles Remarkable"></span>'
+                    if tid % 5 == 0 else
+                    '<span class="UnreadArticles"></span>'
+                    if tid % 3 == 0 else "")
+            changed = strftime("%m/%d/%Y %H:%M",
+                               localtime(ticket_mtime(tid, now)))
+            title = escape(ticket_title(tid))
+            out.append(
+                '<tr class="MasterAction"><td>%s</td><td><a href="%sAction='
+                'AgentTicketZoom;TicketID=%d" title="%s" class="AsBlock Mas'
+                'terActionLink">%d</a></td><td><div title="%s">%s</div></td>'
+                '<td><div title="agent%d">agent%d</div></td><td><div title='
+                '"%s">%s</div></td></tr>\n' % (
+                    mark, BASE, tid, title, ticket_number(tid), changed,
+                    changed, tid % 7, tid % 7, title, title))
+            tid += 1
+        out.append('</tbody></table></div>\n</div>\n')
+    out.append('<div id="Footer"></div>\n<script type="text/javascript">'
+               '//<![CDATA[\nCore.App.Ready(function () {});\n//]]></script>'
+               '\n</body></html>\n')
+    return "".join(out).encode()
+
+
+def article_id(ticket_id, index):
+    return ticket_id * 10000 + index + 1
+
+
+def article_detail(ticket_id, art_id, iframe=True):
+    "Mail header and body of the article as in the zoom page"
+    rnd = Random(art_id)
+    out = ['<div class="ArticleMailHeader"><fieldset class="TableLike">']
+    for label, value in (
+            ("From", "user%d@example.com" % (art_id % 97)),
+            ("To", "support@example.com"),
+            ("Subject", _words(rnd, 6)),
+            ("Created", strftime("%Y-%m-%d %H:%M:%S",
+                                 localtime(ticket_mtime(art_id))))):
+        out.append('<label>%s:</label><p class="Value" title="%s">%s</p>' % (
+            label, escape(value), escape(value)))
+    out.append('</fieldset></div>\n')
+    if iframe:
+        out.append(
+            '<div class="ArticleMailContent"><iframe src="%sAction=AgentTic'
+            'ketAttachment;Subaction=HTMLView;ArticleID=%d;FileID=1;TicketI'
+            'D=%d" frameborder="0"></iframe></div>\n' % (
+                BASE, art_id, ticket_id))
+    else:
+        out.append('<div class="ArticleMailContent"><div class="ArticleBody"'
+                   '>%s</div></div>\n' % escape(_words(rnd, 200)))
+    return "".join(out)
+
+
+def ticket_page(ticket_id, articles=10, now=None):
+    "Ticket zoom page with the articles"
+    title = escape(ticket_title(ticket_id))
+    number = ticket_number(ticket_id)
+    out = ['<!DOCTYPE html>\n<html><head><title>%d - %s - OTRS</title>'
+           '</head>\n<body class="TicketZoom">\n' % (number, title)]
+    out.append(
+        '<div class="Headline"><h1 title="%s">Ticket#%d &mdash; %s</h1>'
+        '</div>\n<div class="ActionRow Cluster"><ul class="Actions">' % (
+            title, number, title))
+    for act in ("AgentTicketLock;Subaction=Lock", "AgentTicketNote",
+                "AgentTicketOwner", "AgentTicketCustomer",
+                "AgentTicketClose", "AgentTicketMerge"):
+        out.append('<li><a href="%sAction=%s;TicketID=%d">%s</a></li>' % (
+            BASE, act, ticket_id, act.split(";")[0]))
+    out.append('<li><form><select name="DestQueueID">')
+    for qid, qname in ((1, "Postmaster"), (2, "Raw"), (3, "Junk"),
+                       (4, "Misc")):
+        out.append('<option value="%d">%s</option>' % (qid, qname))
+    out.append('</select></form></li></ul></div>\n')
+    out.append('<div class="WidgetSimple"><div class="Header"><h2>Ticket '
+               'Information</h2></div><div class="Content"><fieldset class="'
+               'TableLike">')
+    for label, value in (("Age", "%d d" % (ticket_id % 30)),
+                         ("State", "open"), ("Queue", "Raw"),
+                         ("Priority", "3 normal"),
+                         ("Owner", "agent%d" % (ticket_id % 7))):
+        out.append('<label>%s:</label><p class="Value" title="%s">%s</p>' % (
+            label, value, value))
+    out.append('</fieldset></div></div>\n')
+    out.append('<div class="WidgetSimple Expanded"><div class="Content">'
+               '<table id="ArticleTable" class="TableSmall"><thead><tr><th>'
+               'No</th><th>From</th><th>Subject</th><th>Created</th></tr>'
+               '</thead>\n<tbody>\n')
+    base_time = ticket_mtime(ticket_id, now) - articles * 600
+    for i in range(articles):
+        art_id = article_id(ticket_id, i)
+        rnd = Random(art_id)
+        row = SENDERS[art_id % len(SENDERS)]
+        if i >= articles - 2:
+            row += " UnreadArticles"
+        created = strftime("%Y-%m-%d %H:%M:%S",
+                           localtime(base_time + i * 600))
+        subject = escape(_words(rnd, 6))
+        sender = "user%d@example.com" % (art_id % 97)
+        out.append(
+            '<tr class="%s"><td class="No"><input type="hidden" class="'
+            'ArticleInfo" value="%sAction=AgentTicketZoom;TicketID=%d;Artic'
+            'leID=%d"/>%d</td><td class="From"><input type="hidden" class="'
+            'SortData" value="%s"/>%s</td><td class="Subject"><input type="'
+            'hidden" class="SortData" value="%s"/>%s</td><td class="Created"'
+            '><input type="hidden" class="SortData" value="%s"/>%s</td></tr>'
+            '\n' % (row, BASE, ticket_id, art_id, i + 1, sender, sender,
+                    subject, subject, created, created))
+    out.append('</tbody></table></div></div>\n')
+    last = article_id(ticket_id, articles - 1)
+    out.append('<div class="WidgetSimple Expanded ArticleWidget">'
+               '<div class="LightRow Bottom"><ul class="Actions">')
+    for act in ("AgentTicketCompose", "AgentTicketForward"):
+        out.append('<li><a href="%sAction=%s;TicketID=%d;ArticleID=%d">%s'
+                   '</a></li>' % (BASE, act, ticket_id, last, act))
+    out.append('<li><form><select name="ResponseID">')
+    for rid, rname in ((1, "empty answer"), (2, "default reply")):
+        out.append('<option value="%d">%s</option>' % (rid, rname))
+    out.append('</select></form></li></ul></div>\n')
+    if articles:
+        out.append(article_detail(ticket_id, last))
+    out.append('</div>\n<div id="Footer"></div>\n</body></html>\n')
+    return "".join(out).encode()
+
+
+def article_page(ticket_id, art_id):
+    "Response of the ArticleUpdate subaction"
+    return article_detail(ticket_id, art_id).encode()
+
+
+def message_page(size=1024, seed=0):
+    "HTML mail of about the given size in bytes"
+    rnd = Random(seed)
+    out = ['<html><head><meta charset="utf-8"></head><body>\n']
+    total = len(out[0])
+    while total < size:
+        kind = rnd.randrange(6)
+        if kind == 0:
+            part = '<p>%s</p>\n' % _words(rnd, 30)
+        elif kind == 1:
+            part = '<div><b>%s</b> %s<br/>\n%s</div>\n' % (
+                _words(rnd, 2), _words(rnd, 12), _words(rnd, 12))
+        elif kind == 2:
+            part = '<a href="https://example.com/%s">%s</a> &amp; %s<br>\n' % (
+                rnd.choice(WORDS), _words(rnd, 3), _words(rnd, 4))
+        elif kind == 3:
+            part = '<pre>%s\n    %s</pre>\n' % (
+                _words(rnd, 8), _words(rnd, 8))
+        elif kind == 4:
+            part = '<h1>%s</h1>\n' % _words(rnd, 4)
+        else:
+            part = '<span style="color:red">%s</span>&nbsp;%s\n' % (
+                _words(rnd, 5), _words(rnd, 5))
+        out.append(part)
+        total += len(part)
+    out.append('</body></html>\n')
+    return "".join(out).encode()
+
+
+def login_page():
+    return (b'<!DOCTYPE html>\n<html><head><title>Login - OTRS</title>'
+            b'</head><body><form action="/otrs/index.pl" method="post">'
+            b'<input type="hidden" name="Action" value="Login"/>'
+            b'<input type="text" name="User"/><input type="password" '
+            b'name="Password"/></form></body></html>\n')
+
+
+def answer_page(fields=10, options=5):
+    "Form of the compose-like page with its footer and scripts"
+    out = ['<!DOCTYPE html>\n<html><head><title>Compose - OTRS</title>'
+           '</head>\n<body class="Popup">\n<form action="/otrs/index.pl" '
+           'method="post" enctype="multipart/form-data">\n'
+           '<input type="hidden" name="ChallengeToken" value="FakeChallen'
+           'ge"/><input type="hidden" name="Action" value="AgentTicketComp'
+           'ose"/>\n']
+    for i in range(fields):
+        kind = i % 3
+        if kind == 0:
+            out.append('<label for="F%d">Field %d:</label><input type="text"'
+                       ' name="F%d" value="%s"/>\n' % (
+                           i, i, i, escape(_words(Random(i), 3))))
+        elif kind == 1:
+            out.append('<select name="F%d">' % i)
+            for j in range(options):
+                out.append('<option value="%d"%s>%s</option>' % (
+                    j, " selected" if j == i % options else "",
+                    _words(Random(i * 100 + j), 2)))
+            out.append('</select>\n')
+        else:
+            out.append('<textarea name="F%d">%s</textarea>\n' % (
+                i, escape(_words(Random(i), 40))))
+    out.append('</form>\n<div id="Footer"></div>\n<script type="text/javas'
+               'cript">//<![CDATA[\nCore.Agent.CustomerSearch.AddTicketCust'
+               'omer( \'F0\', "Customer <customer@example.com>" );\n//]]>'
+               '</script>\n</body></html>\n')
+    return "".join(out).encode()
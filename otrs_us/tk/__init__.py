@@ -18,8 +18,10 @@ from tkinter import Tk, Menu, PhotoImage, ttk, StringVar, messagebox, \
 from tkinter.filedialog import askdirectory
 from os.path import isdir, join, dirname, pardir
 from os import makedirs
+from concurrent.futures import TimeoutError
 from ..core.settings import Config
 from ..core import get_core
+from ..core.msg_ldr import MessageLoader
 from .tickets import Tickets
 from .dashboard import Dashboard
 from .search import Search
@@ -39,7 +41,7 @@ class Face:
         self.notebook = ntbk = ttk.Notebook(root, takefocus=False)
         self.app_widgets = appw = {
             "core": core, "config": config, "root": root,
-            "notebook": ntbk}
+            "notebook": ntbk, "message loader": MessageLoader(core)}
         for name, obj, lab in (
                 ("dashboard", Dashboard, _("Dashboard")),
                 ("tickets", Tickets, _("Ticket")),
@@ -60,6 +62,21 @@ class Face:
         root.tk.call("wm", "iconphoto", root._w,
                      PhotoImage(file=join(dirname(__file__), "icon.gif")))
         root.after(500, appw["dashboard"].update)
+        core.call("parse offload").waiter = self.wait_future
+        self.pump_engine()
+
+    def wait_future(self, fut):
+        "Keep the window painted while the page is parsed by other process"
+        while True:
+            try:
+                return fut.result(.05)
+            except TimeoutError:
+                self.root.update_idletasks()
+
+    def pump_engine(self):
+        "Take the results of the background loaders"
+        self.core.call("engine").pump()
+        self.root.after(50, self.pump_engine)
 
     def add_menu(self):
         top = self.root.winfo_toplevel()
@@ -45,7 +45,8 @@ class Dashboard(ttk.Frame):
         pw.pack(fill="both")
         self.important = PhotoImage(
             file=join(dirname(__file__), "important.gif"))
-        self.updater = DashboardUpdater(appw["core"])
+        self.updater = DashboardUpdater(
+            appw["core"], appw["message loader"])
         self.login_escaped = False
         self.login_failed = 0
 
@@ -84,17 +85,16 @@ class Dashboard(ttk.Frame):
         self.echo("\033[0;7m%s\033[0m>>> %s: %s" % (
             strftime("%H:%M:%S"), status, self.updater.get_info()))
         if status == "Wait":
-            self.root.after(1000, self.update)
+            # the loader calls update when it finishes
             return
         if status == "Ready":
-            self.updater.start_loader(runt_cfg.get("site", ""))
-            self.root.after(1000, self.update)
+            self.updater.start_loader(runt_cfg.get("site", ""), self.update)
             return
         if status == "LoginError" and not self.login_escaped:
             self.login()
-            self.root.after(1000, self.update)
             self.login_failed += 1
-            return
+            if not self.login_escaped:
+                return
         if status == "Complete":
             res = self.updater.get_result()
             if res is not None:
@@ -221,7 +221,7 @@ class Dashboard(ttk.Frame):
                 if cfg["remember_passwd"]:
                     core_cfg[i] = cfg[i]
             self.echo("Login in Dashboard.login")
-            self.updater.login(cfg)
+            self.updater.login(cfg, self.update)
         else:
             self.login_escaped = True
 
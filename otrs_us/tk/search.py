@@ -64,7 +64,7 @@ class Search(ttk.Frame):
         sexpr = self.entry.get()
         if not sexpr:
             return
-        self.searcher.search(sexpr)
+        self.searcher.search(sexpr, self.update)
         self.update()
 
     def update(self):
@@ -72,8 +72,7 @@ class Search(ttk.Frame):
         if sstatus == "Wait":
             self.app_widgets["core"].call(
                 "print_status", _("Search... (%d)") % self.__elapsed)
-            self.app_widgets["root"].after(1000, self.update)
-            self.__elapsed += 1
+            self.app_widgets["root"].after(1000, self.__tick)
             return
         if sstatus in ("LoginError", "URLError"):
             res = self.searcher.get_result()
@@ -86,6 +85,11 @@ class Search(ttk.Frame):
                 self.cur_sexpr = self.searcher.regexp
                 self.fill_tree(res)
 
+    def __tick(self):
+        if self.searcher.get_status() == "Wait":
+            self.__elapsed += 1
+            self.update()
+
     def fill_tree(self, data):
         tshow = TimeConv(
             yday=_("yest."), mago=_("min."), dago=_("days"))
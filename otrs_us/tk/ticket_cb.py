@@ -17,9 +17,10 @@ from .dialogs import AboutBox, DlgDetails
 from tkinter.messagebox import showerror, showinfo
 from time import ctime
 from traceback import format_exc
+from functools import partial
 import os
 from ..core import version
-from ..core.msg_ldr import MessageLoader, article_by_url, article_type
+from ..core.msg_ldr import article_by_url, article_type
 from ..core.pgload import LoginError
 from ..core.pgload import QuerySender
 
@@ -30,7 +31,7 @@ class Callbacks:
         self.echo = appw["core"].echo
         self.runtime = appw["core"].call("runtime cfg")
         self.core_cfg = appw["core"].call("core cfg")
-        self.loader = MessageLoader(appw["core"])
+        self.loader = appw["message loader"]
         self.articles_range = []
         self.tree_data = {}
         self.cur_article = -2
@@ -471,7 +472,29 @@ class Callbacks:
         DlgDetails(self, _("Download"), cfg=cfg, inputs=(
             ("URL", _("Address:")), ("path", _("Path:"))))
         if cfg["OK button"]:
-            self.loader.download_file(cfg["URL"], cfg["path"])
+            name = os.path.basename(cfg["path"])
+            self.loader.download_file(
+                cfg["URL"], cfg["path"],
+                partial(self.download_progress, name),
+                partial(self.downloaded, name))
+
+    def download_progress(self, name, done, total):
+        if total:
+            message = _("%s: %d of %d KiB") % (name, done >> 10, total >> 10)
+        else:
+            message = _("%s: %d KiB") % (name, done >> 10)
+        self.app_widgets["core"].call("print_status", message)
+
+    def downloaded(self, name, fut):
+        if fut.cancelled():
+            return
+        if fut.exception() is None and fut.result() is not None:
+            message = _("%s is downloaded") % name
+        elif isinstance(fut.exception(), LoginError):
+            message = _("Login required")
+        else:
+            message = _("Download of %s failed") % name
+        self.app_widgets["core"].call("print_status", message)
 
     def dbg_send_request(self, req=None):
         from pprint import pformat
@@ -480,7 +503,7 @@ class Callbacks:
                    inputs=(("query", _("QUERY:")), ("items", _("Items:"))))
         if cfg["OK button"]:
             pg = QuerySender(self.app_widgets["core"])
-            otab = pg.send(cfg["query"], int(cfg["items"]))
+            otab = pg.send(cfg["query"], int(cfg["items"])) or ()
             text = self.text
             text["state"] = "normal"
             text.delete("1.0", "end")